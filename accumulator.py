@@ -0,0 +1,61 @@
+import json
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from messages import FORMAT_BATCH, FORMAT_COLUMNS
+from stop_columns import StopColumns, STOP_COLUMN_TYPES
+
+
+class BatchAccumulator:
+    # the subscriber's in-flight batch: messages are decoded straight into typed
+    # column buffers (see stop_columns) instead of one dict per record, and the
+    # frame handed to validation is built over those buffers without copying
+    def __init__(self, types=STOP_COLUMN_TYPES):
+        self.columns = StopColumns(types)
+        self.messages = 0
+        # set once a columnar stop-row message is in the batch
+        self.stop_rows = False
+        # [rows, service_date] runs in row order, from each message's attribute
+        self.service_dates = []
+
+    def __len__(self):
+        return len(self.columns)
+
+    def add_message(self, data, attributes=None):
+        payload = json.loads(data)
+        attributes = attributes or {}
+        message_format = attributes.get("format")
+        start = len(self.columns)
+        if message_format == FORMAT_COLUMNS:
+            self.columns.extend(StopColumns.from_payload(payload, self.columns.types))
+            self.stop_rows = True
+        elif message_format == FORMAT_BATCH:
+            self.columns.append_rows(payload["fields"], payload["rows"])
+        else:
+            self.columns.append_record(payload)
+        self._date_rows(len(self.columns) - start, attributes.get("service_date"))
+        self.messages += 1
+
+    def _date_rows(self, rows, service_date):
+        # messages from publishers that predate the attribute get today's
+        # service date, computed the way the publisher does
+        service_date = service_date or datetime.now(ZoneInfo("America/Los_Angeles")).strftime("%Y-%m-%d")
+        if self.service_dates and self.service_dates[-1][1] == service_date:
+            self.service_dates[-1][0] += rows
+        else:
+            self.service_dates.append([rows, service_date])
+
+    def to_frame(self):
+        # the accumulator must not be appended to while the frame is in use;
+        # the subscriber starts a new one for every batch
+        import numpy as np
+        import pandas as pd
+        df = self.columns.to_frame()
+        names = list(dict.fromkeys(service_date for _, service_date in self.service_dates))
+        codes = np.repeat([names.index(service_date) for _, service_date in self.service_dates],
+                          [rows for rows, _ in self.service_dates]).astype(np.int32)
+        df["service_date"] = pd.Categorical.from_codes(codes, categories=names)
+        if not self.stop_rows:
+            # one record per trip: a repeated trip_id is a redelivery
+            return df.drop_duplicates(subset=['trip_id'])
+        # many stop rows per trip: only identical rows are redeliveries
+        return df.drop_duplicates()
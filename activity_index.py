@@ -0,0 +1,64 @@
+import json
+import os
+from datetime import date
+
+
+class ActivityIndex:
+    # per-vehicle history of past runs, used to query active vehicles first and
+    # probe vehicles that keep coming back empty less and less often
+    def __init__(self, path, dormant_after=3, max_probe_interval=7):
+        self.path = path
+        self.dormant_after = dormant_after
+        self.max_probe_interval = max_probe_interval
+        self.vehicles = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.vehicles, f)
+        os.replace(tmp_path, self.path)
+
+    def record(self, vehicle_id, service_date, record_count):
+        stats = self.vehicles.setdefault(vehicle_id, {
+            "attempts": 0, "hits": 0, "misses": 0, "avg_records": 0.0, "last_seen": None, "last_probe": None
+        })
+        # several runs a day shouldn't push an idle-today vehicle into dormancy
+        repeat = stats["last_probe"] == service_date
+        stats["attempts"] += 1
+        stats["last_probe"] = service_date
+        if record_count:
+            stats["hits"] += 1
+            stats["misses"] = 0
+            stats["last_seen"] = service_date
+            # moving average so the typical count follows recent behaviour
+            stats["avg_records"] += (record_count - stats["avg_records"]) * 0.3
+        elif not repeat:
+            stats["misses"] += 1
+
+    def is_due(self, vehicle_id, service_date):
+        stats = self.vehicles.get(vehicle_id)
+        if stats is None or stats["misses"] < self.dormant_after or not stats["last_probe"]:
+            return True
+        interval = min(2 ** (stats["misses"] - self.dormant_after), self.max_probe_interval)
+        elapsed = (date.fromisoformat(service_date) - date.fromisoformat(stats["last_probe"])).days
+        return elapsed >= interval
+
+    def _priority(self, vehicle_id):
+        stats = self.vehicles.get(vehicle_id)
+        if stats is None:
+            # never queried: behind known-active vehicles, ahead of dormant ones
+            return (1, 0.5, 0.0)
+        hit_rate = stats["hits"] / stats["attempts"] if stats["attempts"] else 0.0
+        active = 0 if stats["misses"] < self.dormant_after and stats["hits"] else 2
+        return (active, -hit_rate, -stats["avg_records"])
+
+    def schedule(self, vehicle_ids, service_date):
+        due = [vehicle_id for vehicle_id in vehicle_ids if self.is_due(vehicle_id, service_date)]
+        return sorted(due, key=self._priority)
@@ -0,0 +1,86 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+DATA_FILE = "records.ndjson.gz"
+MANIFEST_FILE = "manifest.json"
+
+
+def load_manifest(day_dir):
+    try:
+        with open(os.path.join(day_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class DayArchive:
+    # one file per service date: each vehicle's records are a separate gzip
+    # member of NDJSON, and manifest.json records where each member starts, its
+    # compressed length, record count, uncompressed size and sha256, so counts
+    # come from the manifest and a single vehicle can be read with one seek
+    def __init__(self, day_dir):
+        self.day_dir = day_dir
+        self.data_path = os.path.join(day_dir, DATA_FILE)
+        self.manifest_path = os.path.join(day_dir, MANIFEST_FILE)
+        self._lock = threading.Lock()
+        os.makedirs(day_dir, exist_ok=True)
+        self.manifest = load_manifest(day_dir) or {
+            "service_date": os.path.basename(os.path.normpath(day_dir)),
+            "vehicles": {}
+        }
+
+    def append(self, vehicle_id, records):
+        body = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+        member = gzip.compress(body)
+        entry = {
+            "records": len(records),
+            "bytes": len(body),
+            "length": len(member),
+            "sha256": hashlib.sha256(member).hexdigest()
+        }
+        with self._lock:
+            with open(self.data_path, "ab") as f:
+                entry["offset"] = f.tell()
+                f.write(member)
+            # a re-fetched vehicle points at its newest member; the old one is left unreferenced
+            self.manifest["vehicles"][str(vehicle_id)] = entry
+            self._write_manifest()
+        return entry
+
+    def _write_manifest(self):
+        vehicles = self.manifest["vehicles"]
+        self.manifest["total_records"] = sum(entry["records"] for entry in vehicles.values())
+        self.manifest["total_bytes"] = sum(entry["bytes"] for entry in vehicles.values())
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def vehicle_ids(self):
+        return list(self.manifest["vehicles"])
+
+    def _read_member(self, entry):
+        with open(self.data_path, "rb") as f:
+            f.seek(entry["offset"])
+            return f.read(entry["length"])
+
+    def read_vehicle(self, vehicle_id, verify=False):
+        entry = self.manifest["vehicles"][str(vehicle_id)]
+        member = self._read_member(entry)
+        if verify and hashlib.sha256(member).hexdigest() != entry["sha256"]:
+            raise ValueError(f"checksum mismatch for vehicle {vehicle_id} in {self.data_path}")
+        return [json.loads(line) for line in gzip.decompress(member).splitlines() if line]
+
+    def check(self, verify=False):
+        # completeness check from the manifest alone; verify also re-hashes each member
+        problems = []
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        for vehicle_id, entry in self.manifest["vehicles"].items():
+            if entry["offset"] + entry["length"] > size:
+                problems.append(f"vehicle {vehicle_id}: member extends past end of {DATA_FILE}")
+            elif verify and hashlib.sha256(self._read_member(entry)).hexdigest() != entry["sha256"]:
+                problems.append(f"vehicle {vehicle_id}: checksum mismatch")
+        return problems
@@ -0,0 +1,186 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+from concurrent import futures
+from datetime import date, timedelta
+import pandas as pd
+from dotenv import load_dotenv
+from validation import validate, write_quarantine
+from trip_store import to_trip_frame, copy_trips
+from db_pool import get_pool
+from archive import DayArchive, load_manifest, MANIFEST_FILE
+
+load_dotenv()
+
+DATA_DIR = "/opt/shared/mov-data-pipeline-stop/bus_data"
+OUTPUT_DIR = "/opt/shared/mov-data-pipeline-stop/output2"
+TableName = "trip"
+
+
+def date_range(start, end):
+    day = date.fromisoformat(start)
+    last = date.fromisoformat(end)
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+def find_files(args):
+    # units of work: legacy per-vehicle JSON files, and "<day_dir>#<vehicle_id>"
+    # for vehicles stored in a day's packed archive
+    if args.glob:
+        files = []
+        for path in sorted(glob.glob(args.glob)):
+            if os.path.isdir(path):
+                files.extend(day_units(path))
+            elif os.path.basename(path) == MANIFEST_FILE:
+                # a matched manifest stands for every vehicle in that day's archive
+                files.extend(archive_units(os.path.dirname(path)))
+            else:
+                files.append(path)
+        return files
+    files = []
+    for day in date_range(args.start, args.end or args.start):
+        files.extend(day_units(os.path.join(args.data_dir, day)))
+    return files
+
+
+def archive_units(day_dir):
+    manifest = load_manifest(day_dir)
+    if manifest is None:
+        return []
+    return [f"{day_dir}#{vehicle_id}" for vehicle_id in manifest["vehicles"]]
+
+
+def day_units(day_dir):
+    legacy = glob.glob(os.path.join(day_dir, "*.json"))
+    return archive_units(day_dir) + sorted(path for path in legacy if os.path.basename(path) != MANIFEST_FILE)
+
+
+_ARCHIVES = {}
+
+
+def load_records(unit):
+    if "#" in unit:
+        day_dir, vehicle_id = unit.rsplit("#", 1)
+        if day_dir not in _ARCHIVES:
+            _ARCHIVES[day_dir] = DayArchive(day_dir)
+        return _ARCHIVES[day_dir].read_vehicle(vehicle_id, verify=True)
+    with open(unit, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def record_checkpoint(path, files):
+    with open(path, "a") as f:
+        for file in files:
+            f.write(file + "\n")
+
+
+def store_batch(records, quarantine_dir, binary):
+    df = pd.DataFrame(records)
+    df = df.drop_duplicates(subset=["trip_id"])
+    df, quarantine = validate(df)
+    write_quarantine(quarantine, quarantine_dir)
+    if df.empty:
+        return 0
+    with get_pool().connection() as conn:
+        inserted = copy_trips(conn, to_trip_frame(df), TableName, binary=binary)
+        conn.commit()
+    return inserted
+
+
+def process_files(paths, output_dir, batch_size, binary):
+    # runs in a worker process: parse and validate a slice of files and load
+    # them in COPY batches of batch_size records over the worker's own pool
+    quarantine_dir = os.path.join(output_dir, "quarantine")
+    records = []
+    inserted = 0
+    # only files that loaded are reported back, so failed ones stay out of
+    # the checkpoint and are retried on the next run
+    loaded = []
+    for path in paths:
+        try:
+            records.extend(load_records(path))
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            continue
+        loaded.append(path)
+        if len(records) >= batch_size:
+            inserted += store_batch(records, quarantine_dir, binary)
+            records = []
+    if records:
+        inserted += store_batch(records, quarantine_dir, binary)
+
+    for path in loaded:
+        if "#" in path:
+            continue
+        day_dir = os.path.join(output_dir, os.path.basename(os.path.dirname(path)))
+        os.makedirs(day_dir, exist_ok=True)
+        shutil.copy(path, os.path.join(day_dir, os.path.basename(path)))
+    return loaded, inserted
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load archived stop-event files into the trip table.")
+    parser.add_argument("--start", help="first service date (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last service date, inclusive (defaults to --start)")
+    parser.add_argument("--glob", help="explicit file glob instead of a date range")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--files-per-task", type=int, default=25)
+    parser.add_argument("--batch-size", type=int, default=20000, help="records per COPY")
+    parser.add_argument("--checkpoint", help="completed-files log (defaults to <output-dir>/backfill.checkpoint)")
+    parser.add_argument("--binary", action="store_true", help="use binary COPY")
+    args = parser.parse_args(argv)
+    if not args.glob and not args.start:
+        parser.error("either --start or --glob is required")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    checkpoint = args.checkpoint or os.path.join(args.output_dir, "backfill.checkpoint")
+
+    done = load_checkpoint(checkpoint)
+    files = [file for file in find_files(args) if file not in done]
+    if not files:
+        print("No files found")
+        return
+    print(f"found {len(files)} files ({len(done)} already loaded)")
+
+    total = 0
+    with futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        tasks = {
+            executor.submit(process_files, chunk, args.output_dir, args.batch_size, args.binary): chunk
+            for chunk in chunked(files, args.files_per_task)
+        }
+        for future in futures.as_completed(tasks):
+            try:
+                paths, inserted = future.result()
+            except Exception as e:
+                print(f"Error processing {len(tasks[future])} files: {e}")
+                continue
+            record_checkpoint(checkpoint, paths)
+            total += inserted
+            print(f"stored {inserted} records from {len(paths)} files")
+    print(f"done, stored {total} records")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import argparse
+import json
+import random
+import sqlite3
+import subprocess
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from fetch_engine import FetchEngine
+from stop_parser import parse_stop_events
+from messages import FORMAT_BATCH, encode_batch, encode_record, chunk_records
+from accumulator import BatchAccumulator
+from transport import QueueTransport
+from validation import validate
+from trip_store import TRIP_COLUMNS, CopyStream, binary_rows, text_rows, to_trip_frame
+
+COLUMNS = [
+    "vehicle_number", "leave_time", "train", "route_number", "direction", "service_key",
+    "trip_number", "stop_time", "arrive_time", "dwell", "location_id", "door", "lift", "ons",
+    "offs", "estimated_load", "maximum_speed", "train_mileage", "pattern_distance",
+    "location_distance", "x_coordinate", "y_coordinate", "data_source", "schedule_status"
+]
+
+# trip table column types for the binary COPY stage; the enums go out as text
+TRIP_TYPNAMES = {"trip_id": "int4", "route_id": "int4", "vehicle_id": "int4",
+                 "service_key": "service_type", "direction": "tripdir_type"}
+COPY_READ_SIZE = 8192
+
+
+def generate_row(rng, vehicle_id, route, direction, service_key, trip_number, stop_time):
+    values = {
+        "vehicle_number": vehicle_id,
+        "leave_time": stop_time + rng.randint(0, 60),
+        "train": rng.randint(1000, 9999),
+        "route_number": route,
+        "direction": direction,
+        "service_key": service_key,
+        "trip_number": trip_number,
+        "stop_time": stop_time,
+        "arrive_time": stop_time - rng.randint(0, 30),
+        "dwell": rng.randint(0, 60),
+        "location_id": rng.randint(1, 14000),
+        "door": rng.randint(0, 2),
+        "lift": 0,
+        "ons": rng.randint(0, 12),
+        "offs": rng.randint(0, 12),
+        "estimated_load": rng.randint(0, 60),
+        "maximum_speed": rng.randint(0, 55),
+        "train_mileage": round(rng.uniform(0, 300), 2),
+        "pattern_distance": round(rng.uniform(0, 60000), 1),
+        "location_distance": round(rng.uniform(0, 60000), 1),
+        "x_coordinate": round(rng.uniform(7600000, 7700000), 1),
+        "y_coordinate": round(rng.uniform(640000, 720000), 1),
+        "data_source": 0,
+        "schedule_status": rng.randint(0, 6)
+    }
+    return "<tr>" + "".join(f"<td>{values[column]}</td>" for column in COLUMNS) + "</tr>"
+
+
+def generate_page(vehicle_id, trips, rows, rng):
+    # same shape as getStopEvents: an <h2> naming the trip, then its stop table
+    parts = [f"<html><head><title>Stop events</title></head><body>"
+             f"<h1>Trimet CAD/AVL stop data for vehicle {vehicle_id}</h1>"]
+    header = "<tr>" + "".join(f"<th>{column}</th>" for column in COLUMNS) + "</tr>"
+    trip_id = rng.randint(200000000, 270000000)
+    for trip in range(trips):
+        trip_id += rng.randint(1, 500)
+        route = rng.choice([2, 4, 6, 8, 9, 12, 14, 15, 17, 20, 33, 57, 72, 75])
+        direction = rng.randint(0, 1)
+        service_key = rng.choice("WWWWWSU")
+        trip_number = rng.randint(1000, 9999)
+        stop_time = 18000 + trip * 3600
+        parts.append(f"<h2>Stop events for PDX_TRIP {trip_id}</h2><table border=1>{header}")
+        for row in range(rows):
+            parts.append(generate_row(rng, vehicle_id, route, direction, service_key, trip_number, stop_time + row * 90))
+        parts.append("</table>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def generate_pages(vehicles, trips, rows, seed):
+    rng = random.Random(seed)
+    return {str(3000 + index): generate_page(str(3000 + index), trips, rows, rng) for index in range(vehicles)}
+
+
+def serve_pages(pages):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            vehicle_id = parse_qs(urlparse(self.path).query).get("vehicle_num", [""])[0]
+            page = pages.get(vehicle_id)
+            body = (page or "").encode("utf-8")
+            self.send_response(200 if page else 404)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/getStopEvents"
+
+
+def drain_copy(stream):
+    # reads the way psycopg2's copy_expert does, without a server on the other end
+    total = 0
+    while True:
+        data = stream.read(COPY_READ_SIZE)
+        if not data:
+            return total
+        total += len(data)
+
+
+class SqliteTripSink:
+    # stand-in for the trip table: same columns, INSERT OR IGNORE in place of ON CONFLICT DO NOTHING
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE trip (trip_id INTEGER PRIMARY KEY, route_id INTEGER, vehicle_id INTEGER,"
+            " service_key TEXT, direction TEXT)"
+        )
+
+    def load(self, df):
+        trips = to_trip_frame(df)
+        self.conn.executemany("INSERT OR IGNORE INTO trip VALUES (?, ?, ?, ?, ?)", trips.itertuples(index=False, name=None))
+        self.conn.commit()
+        return len(trips)
+
+
+def measure(name, records, fn, memory):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    stats = {"seconds": round(elapsed, 4)}
+    count = records(result) if callable(records) else records
+    stats["records"] = count
+    stats["records_per_second"] = round(count / elapsed, 1) if elapsed else None
+    if memory:
+        # second run under tracemalloc so tracing overhead doesn't skew the timing
+        tracemalloc.start()
+        fn()
+        stats["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print(f"{name:<11} {stats['seconds']:>9.3f}s {count:>9} rec {stats['records_per_second'] or 0:>12.1f} rec/s"
+          + (f" {stats['peak_memory_bytes'] / 1e6:>9.1f} MB" if memory else ""))
+    return result, stats
+
+
+def drain(transport, expected):
+    # decoded into column buffers, the way the subscriber's flush thread does it
+    received = BatchAccumulator()
+    done = threading.Event()
+
+    def callback(message):
+        received.add_message(message.data, message.attributes)
+        message.ack()
+        if len(received) >= expected:
+            done.set()
+
+    future = transport.subscribe(callback)
+    done.wait(timeout=60)
+    future.cancel()
+    future.result(timeout=5)
+    return received
+
+
+def publish_all(transport, records, records_per_message):
+    if records_per_message == 1:
+        for record in records:
+            transport.publish(encode_record(record))
+        return
+    for chunk in chunk_records(records, records_per_message):
+        transport.publish(encode_batch(chunk), format=FORMAT_BATCH)
+
+
+def run(args):
+    pages = generate_pages(args.vehicles, args.trips, args.rows, args.seed)
+    server, url = serve_pages(pages)
+    vehicle_ids = list(pages)
+    results = {}
+    counter = iter(range(1000000))
+
+    def topic():
+        return f"bench-{next(counter)}"
+
+    def fetch():
+        with FetchEngine(max_in_flight=args.concurrency, base_url=url) as engine:
+            return [result.content for result in engine.fetch_all(vehicle_ids)]
+
+    contents, results["fetch"] = measure("fetch", len(vehicle_ids), fetch, args.memory)
+
+    def parse():
+        records = []
+        for content in contents:
+            records.extend(parse_stop_events(content).records)
+        return records
+
+    records, results["parse"] = measure("parse", len, parse, args.memory)
+
+    def publish():
+        transport = QueueTransport(topic(), max_pending=len(records) + 1)
+        publish_all(transport, records, args.records_per_message)
+        return transport
+
+    _, results["publish"] = measure("publish", len(records), publish, args.memory)
+
+    def subscribe():
+        transport = QueueTransport(topic(), max_pending=len(records) + 1)
+        publish_all(transport, records, args.records_per_message)
+        return drain(transport, len(records))
+
+    received, results["subscribe"] = measure("subscribe", len, subscribe, args.memory)
+
+    def validate_stage():
+        return validate(received.to_frame())[0]
+
+    valid, results["validate"] = measure("validate", len(received), validate_stage, args.memory)
+    _, results["load"] = measure("load", len(valid), lambda: SqliteTripSink().load(valid), args.memory)
+
+    # what store_database's COPY sends, minus the network: frame to wire bytes
+    trips = to_trip_frame(valid)
+    typnames = [TRIP_TYPNAMES[column] for column in TRIP_COLUMNS]
+    _, results["copy_text"] = measure(
+        "copy_text", len(trips), lambda: drain_copy(CopyStream(text_rows(trips))), args.memory)
+    _, results["copy_binary"] = measure(
+        "copy_binary", len(trips), lambda: drain_copy(CopyStream(binary_rows(trips, typnames))), args.memory)
+
+    def pipeline():
+        # publisher and subscriber running concurrently, as in production
+        transport = QueueTransport(topic(), max_pending=10000)
+        sink = SqliteTripSink()
+        expected = len(records)
+        pulled = []
+        consumer = threading.Thread(target=lambda: pulled.append(drain(transport, expected)))
+        consumer.start()
+        with FetchEngine(max_in_flight=args.concurrency, base_url=url) as engine:
+            for result in engine.fetch_all(vehicle_ids):
+                publish_all(transport, parse_stop_events(result.content).records, args.records_per_message)
+        consumer.join()
+        return sink.load(validate(pulled[0].to_frame())[0])
+
+    _, results["pipeline"] = measure("pipeline", len(records), pipeline, args.memory)
+    server.shutdown()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\ncompared with {baseline.get('revision')} ({baseline_path}):")
+    for stage, stats in results.items():
+        before = baseline["stages"].get(stage, {}).get("records_per_second")
+        after = stats.get("records_per_second")
+        if before and after:
+            print(f"{stage:<11} {(after - before) / before * 100:>+8.1f}% rec/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stop-event pipeline against synthetic pages and local stand-ins.")
+    parser.add_argument("--vehicles", type=int, default=50)
+    parser.add_argument("--trips", type=int, default=20, help="trips (tables) per vehicle page")
+    parser.add_argument("--rows", type=int, default=60, help="stop rows per trip table")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--records-per-message", type=int, default=1)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the peak-memory pass")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="earlier --output file to diff against")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    report = {"revision": git_revision(), "params": vars(args), "stages": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import sqlite3
+import threading
+import time
+
+
+class PublishCheckpoint:
+    # trip_ids already published and acked, per service date and vehicle; the
+    # publisher consults it so re-runs only emit trips it hasn't sent yet
+    def __init__(self, path, flush_rows=10000):
+        self.path = path
+        self.flush_rows = flush_rows
+        self._lock = threading.Lock()
+        # marks are buffered and written flush_rows at a time in one transaction;
+        # ones lost in a crash only mean those trips are published again
+        self._marks = []
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS published ("
+                " service_date TEXT NOT NULL,"
+                " vehicle_id TEXT NOT NULL,"
+                " trip_id TEXT NOT NULL,"
+                " acked_at REAL NOT NULL,"
+                " PRIMARY KEY (service_date, vehicle_id, trip_id))"
+            )
+            self._conn.commit()
+
+    def published(self, service_date, vehicle_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT trip_id FROM published WHERE service_date = ? AND vehicle_id = ?",
+                (service_date, vehicle_id)
+            ).fetchall()
+            buffered = {mark[2] for mark in self._marks if mark[0] == service_date and mark[1] == vehicle_id}
+        return {row[0] for row in rows} | buffered
+
+    def filter_new(self, service_date, vehicle_id, records):
+        seen = self.published(service_date, vehicle_id)
+        return [record for record in records if str(record["trip_id"]) not in seen]
+
+    def mark(self, service_date, vehicle_id, trip_ids):
+        now = time.time()
+        with self._lock:
+            self._marks.extend((service_date, vehicle_id, str(trip_id), now) for trip_id in trip_ids)
+            if len(self._marks) < self.flush_rows:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            marks, self._marks = self._marks, []
+            if not marks:
+                return
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO published (service_date, vehicle_id, trip_id, acked_at) VALUES (?, ?, ?, ?)",
+                marks
+            )
+            self._conn.commit()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
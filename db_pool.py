@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool
+
+# applied to every pooled session; bulk loads don't need to wait for the WAL flush
+SESSION_SETTINGS = {"synchronous_commit": "off"}
+
+
+class ConnectionPool:
+    def __init__(self, minconn=1, maxconn=4, session_settings=None, health_check_interval=30, **connect_kwargs):
+        self.session_settings = SESSION_SETTINGS if session_settings is None else session_settings
+        self.health_check_interval = health_check_interval
+        options = " ".join(f"-c {name}={value}" for name, value in self.session_settings.items())
+        if options:
+            connect_kwargs["options"] = options
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        with self._lock:
+            last_used = self._last_used.get(id(conn), 0)
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, attempts=3):
+        for attempt in range(attempts):
+            try:
+                conn = self._pool.getconn()
+            except psycopg2.OperationalError as e:
+                print(f"Error connecting to database: {e}")
+                time.sleep(2 ** attempt)
+                continue
+            if self._healthy(conn):
+                return conn
+            # stale connection: drop it and let the pool open a fresh one
+            self._discard(conn)
+        raise psycopg2.OperationalError("could not get a healthy database connection")
+
+    def _discard(self, conn):
+        with self._lock:
+            self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def putconn(self, conn):
+        if conn.closed:
+            self._discard(conn)
+            return
+        with self._lock:
+            self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._discard(conn)
+            conn = None
+            raise
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if conn is not None:
+                self.putconn(conn)
+
+    def close(self):
+        self._pool.closeall()
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    # one pool per process, configured from the same env vars db_connect used
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ConnectionPool(
+                minconn=int(os.getenv("DB_POOL_MIN", "1")),
+                maxconn=int(os.getenv("DB_POOL_MAX", "4")),
+                session_settings={"synchronous_commit": os.getenv("DB_SYNCHRONOUS_COMMIT", "off")},
+                dbname=os.getenv("DB_NAME"),
+                user=os.getenv("DB_USER"),
+                password=os.getenv("DB_PASSWORD"),
+                host=os.getenv("DB_HOST")
+            )
+        return _POOL
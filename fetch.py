@@ -1,9 +1,12 @@
-import requests
-from bs4 import BeautifulSoup
-import json
 import os
 from datetime import datetime
 from zoneinfo import ZoneInfo
+from fetch_engine import FetchEngine
+from request_policy import RequestPolicy
+from stop_parser import parse_stop_events
+from response_cache import ResponseCache
+from activity_index import ActivityIndex
+from archive import DayArchive
 
 # Load vehicle IDs
 with open("/opt/shared/mov-data-pipeline-stop/vehicle_IDs.txt", "r") as f:
@@ -14,57 +17,59 @@ with open("/opt/shared/mov-data-pipeline-stop/vehicle_IDs.txt", "r") as f:
 now = datetime.now(ZoneInfo("America/Los_Angeles"))
 today = now.strftime("%Y-%m-%d")
 
-# Create output directory for the day
+# Open the day's packed archive
 output_dir = f"/opt/shared/mov-data-pipeline-stop/bus_data/{today}"
-os.makedirs(output_dir, exist_ok=True)
+archive = DayArchive(output_dir)
 
-# Iterate through each vehicle ID
-for vehicle_id in vehicle_ids:
-    url = f"https://busdata.cs.pdx.edu/api/getStopEvents?vehicle_num={vehicle_id}"
-    filename = os.path.join(output_dir, f"{vehicle_id}.json")
+# Query active vehicles first; dormant ones are only probed every few days
+activity = ActivityIndex(os.getenv("ACTIVITY_INDEX", "/opt/shared/mov-data-pipeline-stop/activity_fetch.json"))
+scheduled_ids = activity.schedule(vehicle_ids, today)
+print(f"Scheduled {len(scheduled_ids)} of {len(vehicle_ids)} vehicles")
+
+# Fetch every vehicle concurrently over a pooled session, with retries,
+# rate limiting and an overall deadline from FETCH_* settings
+engine = FetchEngine(
+    max_in_flight=int(os.getenv("FETCH_CONCURRENCY", "16")),
+    policy=RequestPolicy.from_env(),
+    cache=ResponseCache(os.getenv("RESPONSE_CACHE_DIR", "/opt/shared/mov-data-pipeline-stop/cache/fetch"))
+)
+
+spread_seconds = float(os.getenv("FETCH_SPREAD_SECONDS", "0"))
+for result in engine.fetch_all(scheduled_ids, today, spread_seconds=spread_seconds):
+    vehicle_id = result.vehicle_id
+    content = result.content
 
     try:
-        response = requests.get(url)
-        content = response.text.strip()
+        if result.error is not None:
+            print(f"Error for {vehicle_id}: {result.error}")
+            continue
+
+        # Skip pages identical to the last run's
+        if result.unchanged:
+            print(f"No changes for vehicle {vehicle_id} since last run")
+            continue
 
-        if response.status_code != 200:
+        if result.status_code != 200:
             print(f"Failed to fetch data for {vehicle_id}")
+            activity.record(vehicle_id, today, 0)
             continue
 
         # Parse HTML
-        soup = BeautifulSoup(content, "lxml")
-        tables = soup.find_all("table")
-        all_records = []
-        h2s = soup.find_all(name="h2", string=True)
-        trip_ids = []
-        for h2 in h2s:
-          trip_ids.append(str(h2).strip("</h2>").split()[-1])
-        
-        trip_id_counter = 0
-        for table in tables:
-            if int(trip_ids[trip_id_counter]) <= 0:
-                trip_id_counter += 1
-                continue
-            headers = [th.text.strip() for th in table.find_all("th")]
-            headers.append("trip_id")
-            first_row = table.find_all("tr")[1]
-            cells = [td.text.strip() for td in first_row.find_all("td")]
-            if cells:
-                record = dict(zip(headers, cells))
-                record["trip_id"] = trip_ids[trip_id_counter]
-                all_records.append(record)
-            trip_id_counter += 1
+        all_records = parse_stop_events(content).records
+        activity.record(vehicle_id, today, len(all_records))
 
-        # Write to file if data is found
+        # Append to the day's archive if data is found
         if all_records:
-            with open(filename, "w") as outfile:
-                json.dump(all_records, outfile, indent=2)
+            archive.append(vehicle_id, all_records)
             print(f"Wrote {len(all_records)} records for vehicle {vehicle_id}")
         else:
-            print(f"No data found for vehicle {vehicle_id}, file not created")
+            print(f"No data found for vehicle {vehicle_id}, nothing archived")
+        engine.commit(result)
 
     except Exception as e:
         print(f"Error for {vehicle_id}: {e}")
 
+engine.close()
+activity.save()
 print(f"Finished gathering breadcrumbs for {today}")
 print(f"{len(vehicle_ids)}")
@@ -0,0 +1,109 @@
+import time
+import requests
+from collections import namedtuple
+from concurrent import futures
+from requests.adapters import HTTPAdapter
+from metrics import REGISTRY
+from request_policy import RequestPolicy, DeadlineExceeded
+
+API_URL = "https://busdata.cs.pdx.edu/api/getStopEvents"
+
+# unchanged: the body matches what was processed last time (304 or same content hash);
+# cache_entry: what commit() writes to the cache once the caller has processed the body
+FetchResult = namedtuple(
+    "FetchResult",
+    ["vehicle_id", "status_code", "content", "error", "unchanged", "cache_entry"],
+    defaults=(False, None)
+)
+
+
+class FetchEngine:
+    def __init__(self, max_in_flight=16, connect_timeout=5, read_timeout=30, base_url=API_URL, cache=None, policy=None):
+        self.max_in_flight = max_in_flight
+        self.cache = cache
+        # timeouts, retries, rate limit and run deadline all live on the policy
+        self.policy = policy or RequestPolicy(connect_timeout=connect_timeout, read_timeout=read_timeout)
+        self.base_url = base_url
+        self.session = self._init_session()
+
+    def _init_session(self):
+        # one keep-alive connection per worker thread, shared across every vehicle
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def fetch_one(self, vehicle_id, service_date=None):
+        use_cache = self.cache is not None and service_date is not None
+        headers = self.cache.conditional_headers(vehicle_id, service_date) if use_cache else None
+        REGISTRY.counter("fetch_requests_total", "busdata API requests").inc()
+        try:
+            with REGISTRY.timer("fetch_seconds", "busdata API request latency"):
+                response = self.policy.execute(lambda timeout: self.session.get(
+                    self.base_url, params={"vehicle_num": vehicle_id}, headers=headers, timeout=timeout))
+        except requests.RequestException as e:
+            REGISTRY.counter("fetch_errors_total", "busdata API requests that raised").inc()
+            return FetchResult(vehicle_id, None, "", e)
+
+        if use_cache and response.status_code == 304:
+            REGISTRY.counter("fetch_unchanged_total", "pages identical to the last run").inc()
+            return FetchResult(vehicle_id, 304, "", None, unchanged=True)
+        content = response.text.strip()
+        if not use_cache or response.status_code != 200:
+            return FetchResult(vehicle_id, response.status_code, content, None)
+
+        content_hash = self.cache.content_hash(content)
+        if self.cache.is_unchanged(vehicle_id, service_date, content_hash):
+            REGISTRY.counter("fetch_unchanged_total", "pages identical to the last run").inc()
+            return FetchResult(vehicle_id, 200, content, None, unchanged=True)
+        cache_entry = {
+            "service_date": service_date,
+            "content_hash": content_hash,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+        return FetchResult(vehicle_id, 200, content, None, cache_entry=cache_entry)
+
+    def commit(self, result):
+        # called after the body was parsed and handed off, so a crash in between
+        # means the next run sees it as changed and processes it again
+        if self.cache is None or result.cache_entry is None:
+            return
+        entry = result.cache_entry
+        self.cache.store(result.vehicle_id, entry["service_date"], result.content, entry["content_hash"],
+                         etag=entry["etag"], last_modified=entry["last_modified"])
+
+    def fetch_all(self, vehicle_ids, service_date=None, spread_seconds=0):
+        # sliding window: never more than max_in_flight requests submitted at once,
+        # results are yielded as soon as they complete; spread_seconds paces the
+        # submissions evenly over that period instead of bursting them
+        vehicle_ids = list(vehicle_ids)
+        self.policy.start_run()
+        interval = spread_seconds / len(vehicle_ids) if spread_seconds and vehicle_ids else 0
+        pending = set()
+        with futures.ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            for index, vehicle_id in enumerate(vehicle_ids):
+                if self.policy.expired():
+                    print(f"Run deadline reached, skipping {len(vehicle_ids) - index} vehicles")
+                    for skipped in vehicle_ids[index:]:
+                        yield FetchResult(skipped, None, "", DeadlineExceeded("run deadline reached"))
+                    break
+                if interval and pending:
+                    time.sleep(interval)
+                pending.add(executor.submit(self.fetch_one, vehicle_id, service_date))
+                if len(pending) >= self.max_in_flight:
+                    done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in futures.as_completed(pending):
+                yield future.result()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,69 @@
+import json
+import zlib
+
+FORMAT_BATCH = "batch"
+FORMAT_COLUMNS = "columns"
+# bumped when record fields change meaning; sent as the schema_version attribute
+SCHEMA_VERSION = "1"
+
+
+def encode_record(record):
+    return json.dumps(record).encode("utf-8")
+
+
+def encode_batch(records):
+    # header once, then one positional row per record
+    fields = []
+    for record in records:
+        for key in record:
+            if key not in fields:
+                fields.append(key)
+    rows = [[record.get(field) for field in fields] for record in records]
+    payload = {"fields": fields, "rows": rows}
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def encode_columns(columns):
+    # one list per field, typed; string fields are sent as (categories, codes)
+    return json.dumps(columns.to_payload(), separators=(",", ":")).encode("utf-8")
+
+
+def chunk_records(records, records_per_message):
+    # 0 packs everything into a single message
+    if records_per_message <= 0:
+        yield records
+        return
+    for start in range(0, len(records), records_per_message):
+        yield records[start:start + records_per_message]
+
+
+def message_attributes(vehicle_id, service_date, routes=(), shards=0):
+    # routing metadata readable without decoding the body; route_number only
+    # when every record in the message is on the same route
+    attributes = {"vehicle_id": str(vehicle_id), "service_date": service_date, "schema_version": SCHEMA_VERSION}
+    routes = {route for route in routes if route is not None}
+    if len(routes) == 1:
+        attributes["route_number"] = str(routes.pop())
+    if shards:
+        attributes["shard"] = str(zlib.crc32(str(vehicle_id).encode("utf-8")) % shards)
+    return attributes
+
+
+def parse_attribute_filter(text):
+    # "route_number=20,72;service_date=2024-05-01" -> {"route_number": {"20", "72"}, ...}
+    attribute_filter = {}
+    for clause in (text or "").split(";"):
+        if clause.strip():
+            name, _, values = clause.partition("=")
+            attribute_filter[name.strip()] = {value.strip() for value in values.split(",")}
+    return attribute_filter
+
+
+def matches_filter(attributes, attribute_filter):
+    # messages without an attribute (older publishers) are let through to be decoded
+    for name, allowed in attribute_filter.items():
+        value = (attributes or {}).get(name)
+        if value is not None and value not in allowed:
+            return False
+    return True
+
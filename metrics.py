@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def summary(self):
+        return self.value
+
+    def snapshot(self):
+        return self.value
+
+    def merge(self, state):
+        self.inc(state)
+
+    def samples(self):
+        yield self.name, self.value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 6)
+        }
+
+    def snapshot(self):
+        with self._lock:
+            return {"buckets": list(self.buckets), "counts": list(self.counts), "count": self.count,
+                    "sum": self.sum, "max": self.max}
+
+    def merge(self, state):
+        if tuple(state["buckets"]) != self.buckets:
+            raise ValueError(f"bucket mismatch merging {self.name}")
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, state["counts"])]
+            self.count += state["count"]
+            self.sum += state["sum"]
+            self.max = max(self.max, state["max"])
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound}"}}', cumulative
+        yield f'{self.name}_bucket{{le="+Inf"}}', self.count
+        yield f"{self.name}_sum", self.sum
+        yield f"{self.name}_count", self.count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def _get(self, cls, name, help_text):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help_text)
+            return self.metrics[name]
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text=""):
+        return self._get(Histogram, name, help_text)
+
+    def snapshot(self):
+        # picklable raw state, for shipping a worker process's metrics to its supervisor
+        return {
+            name: {"kind": metric.kind, "help": metric.help_text, "state": metric.snapshot()}
+            for name, metric in list(self.metrics.items())
+        }
+
+    def load(self, snapshots):
+        # replace every metric with the sum of the given snapshots
+        metrics = {}
+        for snapshot in snapshots:
+            for name, entry in snapshot.items():
+                if name not in metrics:
+                    metrics[name] = METRIC_TYPES[entry["kind"]](name, entry["help"])
+                metrics[name].merge(entry["state"])
+        with self._lock:
+            self.metrics = metrics
+
+    @contextmanager
+    def timer(self, name, help_text=""):
+        histogram = self.histogram(name, help_text)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    def render_prometheus(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            if metric.help_text:
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name} {value}" for name, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        return {
+            "started": self.started,
+            "elapsed_seconds": round(time.time() - self.started, 3),
+            "metrics": {name: metric.summary() for name, metric in list(self.metrics.items())}
+        }
+
+    def write_summary(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        print(f"Wrote metrics summary to {path}")
+
+    def serve(self, port, host="127.0.0.1"):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry.render_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/summary":
+                    body = json.dumps(registry.summary()).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+
+METRIC_TYPES = {cls.kind: cls for cls in (Counter, Gauge, Histogram)}
+
+REGISTRY = Registry()
+
+
+def start_from_env():
+    # METRICS_PORT turns on the local /metrics and /summary endpoint
+    port = os.getenv("METRICS_PORT")
+    if port:
+        return REGISTRY.serve(int(port))
+    return None
@@ -0,0 +1,71 @@
+import glob
+import os
+import uuid
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+class ColumnarSink:
+    # one file per micro-batch under <root>/service_date=<date>/route_number=<route>/,
+    # small files of a partition are merged once there are compact_threshold of them
+    def __init__(self, root, file_format="parquet", compression="zstd", compact_threshold=16, compact_every=50):
+        if file_format not in EXTENSIONS:
+            raise ValueError(f"unknown output format {file_format}")
+        self.root = root
+        self.file_format = file_format
+        self.extension = EXTENSIONS[file_format]
+        self.compression = compression
+        self.compact_threshold = compact_threshold
+        self.compact_every = compact_every
+        self.writes = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _partition_dir(self, service_date, route):
+        return os.path.join(self.root, f"service_date={service_date}", f"route_number={route}")
+
+    def _write_table(self, table, path):
+        # write under a dot-name first so readers never see a half-written file
+        tmp_path = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+        if self.file_format == "parquet":
+            pq.write_table(table, tmp_path, compression=self.compression)
+        else:
+            options = ipc.IpcWriteOptions(compression=self.compression)
+            with pa.OSFile(tmp_path, "wb") as sink:
+                with ipc.new_file(sink, table.schema, options=options) as writer:
+                    writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    def _read_table(self, path):
+        if self.file_format == "parquet":
+            return pq.read_table(path)
+        with pa.memory_map(path) as source:
+            return ipc.open_file(source).read_all()
+
+    def write(self, df, service_date):
+        for route, group in df.groupby("route_number", sort=False):
+            directory = self._partition_dir(service_date, route)
+            os.makedirs(directory, exist_ok=True)
+            table = pa.Table.from_pandas(group.drop(columns=["route_number"]), preserve_index=False)
+            self._write_table(table, os.path.join(directory, f"part-{uuid.uuid4().hex}{self.extension}"))
+        self.writes += 1
+        if self.compact_every and self.writes % self.compact_every == 0:
+            self.compact(service_date)
+        return len(df)
+
+    def compact(self, service_date):
+        merged = 0
+        for directory in glob.glob(os.path.join(self.root, f"service_date={service_date}", "route_number=*")):
+            files = sorted(glob.glob(os.path.join(directory, f"*{self.extension}")))
+            if len(files) < self.compact_threshold:
+                continue
+            table = pa.concat_tables([self._read_table(path) for path in files])
+            self._write_table(table, os.path.join(directory, f"compact-{uuid.uuid4().hex}{self.extension}"))
+            for path in files:
+                os.remove(path)
+            merged += len(files)
+        if merged:
+            print(f"compacted {merged} files for {service_date}")
+        return merged
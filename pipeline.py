@@ -0,0 +1,257 @@
+import abc
+import argparse
+import os
+import queue
+import threading
+from concurrent import futures
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import pandas as pd
+from dotenv import load_dotenv
+from fetch_engine import FetchEngine
+from request_policy import RequestPolicy
+from stop_parser import parse_stop_events
+from messages import FORMAT_BATCH, encode_record, encode_batch, chunk_records, message_attributes
+from archive import DayArchive
+from validation import validate, write_quarantine
+from trip_store import TripIdIndex, to_trip_frame, copy_trips
+from db_pool import get_pool
+from metrics import REGISTRY, start_from_env
+from transport import make_transport
+from response_cache import ResponseCache
+
+load_dotenv()
+
+BASE_DIR = "/opt/shared/mov-data-pipeline-stop"
+_STOP = object()
+
+
+class QueuedSink(abc.ABC):
+    # each sink drains its own bounded queue on its own thread, so a slow sink
+    # only falls behind (and eventually pushes back) instead of stalling the rest
+    name = "sink"
+
+    def __init__(self, max_pending=64):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.errors = 0
+        self.thread = threading.Thread(target=self._drain, name=f"{self.name}-sink", daemon=True)
+        self.thread.start()
+
+    def submit(self, vehicle_id, records):
+        self.queue.put((vehicle_id, records))
+        REGISTRY.gauge(f"sink_{self.name}_queue_depth", f"vehicles waiting for the {self.name} sink").set(self.queue.qsize())
+
+    def _drain(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            vehicle_id, records = item
+            try:
+                with REGISTRY.timer(f"sink_{self.name}_seconds", f"{self.name} sink time per vehicle"):
+                    self.handle(vehicle_id, records)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error in {self.name} sink for vehicle {vehicle_id}: {e}")
+        try:
+            self.finish()
+        except Exception as e:
+            self.errors += 1
+            print(f"Error finishing {self.name} sink: {e}")
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+        return self.errors == 0
+
+    @abc.abstractmethod
+    def handle(self, vehicle_id, records):
+        pass
+
+    def finish(self):
+        pass
+
+
+class ArchiveSink(QueuedSink):
+    name = "archive"
+
+    def __init__(self, day_dir, **kwargs):
+        self.archive = DayArchive(day_dir)
+        super().__init__(**kwargs)
+
+    def handle(self, vehicle_id, records):
+        self.archive.append(vehicle_id, records)
+
+
+class PubSubSink(QueuedSink):
+    name = "pubsub"
+
+    def __init__(self, transport, service_date, records_per_message=1, shards=0, **kwargs):
+        self.transport = transport
+        self.service_date = service_date
+        self.records_per_message = records_per_message
+        self.shards = shards
+        self.future_list = []
+        super().__init__(**kwargs)
+
+    def handle(self, vehicle_id, records):
+        if self.records_per_message == 1:
+            for record in records:
+                attributes = self.attributes(vehicle_id, [record])
+                self.future_list.append(self.transport.publish(encode_record(record), **attributes))
+        else:
+            for chunk in chunk_records(records, self.records_per_message):
+                attributes = self.attributes(vehicle_id, chunk)
+                self.future_list.append(self.transport.publish(encode_batch(chunk), format=FORMAT_BATCH, **attributes))
+        # keep only unresolved futures around
+        done, pending = [], []
+        for future in self.future_list:
+            (done if future.done() else pending).append(future)
+        self.future_list = pending
+        self.settle(done)
+
+    def settle(self, done):
+        # a failed publish is a sink error, so the runner doesn't cache the pages
+        for future in done:
+            if future.exception() is not None:
+                self.errors += 1
+                print(f"Error publishing message: {future.exception()}")
+
+    def attributes(self, vehicle_id, records):
+        routes = [record.get("route_number") for record in records]
+        return message_attributes(vehicle_id, self.service_date, routes, self.shards)
+
+    def finish(self):
+        done, _ = futures.wait(self.future_list)
+        self.future_list = []
+        self.settle(done)
+        self.transport.close()
+
+
+class TripLoaderSink(QueuedSink):
+    name = "db"
+
+    def __init__(self, table="trip", batch_size=5000, binary=False, quarantine_dir=None, **kwargs):
+        self.table = table
+        self.batch_size = batch_size
+        self.binary = binary
+        self.quarantine_dir = quarantine_dir
+        self.trip_index = TripIdIndex()
+        self.records = []
+        with get_pool().connection() as conn:
+            self.trip_index.seed(conn, table)
+        super().__init__(**kwargs)
+
+    def handle(self, vehicle_id, records):
+        self.records.extend(records)
+        if len(self.records) >= self.batch_size:
+            self.load()
+
+    def load(self):
+        records, self.records = self.records, []
+        df, quarantine = validate(pd.DataFrame(records).drop_duplicates(subset=["trip_id"]))
+        if self.quarantine_dir:
+            write_quarantine(quarantine, self.quarantine_dir)
+        trips = self.trip_index.filter_new(to_trip_frame(df))
+        if trips.empty:
+            return
+        with get_pool().connection() as conn:
+            # the page cache is committed after this, so it must survive a crash
+            inserted = copy_trips(conn, trips, self.table, binary=self.binary, durable=True)
+            conn.commit()
+        self.trip_index.add(trips["trip_id"])
+        print(f"stored {inserted} records in database")
+
+    def finish(self):
+        if self.records:
+            self.load()
+
+
+class PipelineRunner:
+    def __init__(self, vehicle_ids, fetcher, sinks, service_date):
+        self.vehicle_ids = vehicle_ids
+        self.fetcher = fetcher
+        self.sinks = sinks
+        self.service_date = service_date
+
+    def run(self):
+        print(f"Collecting stop events for {self.service_date} into {', '.join(sink.name for sink in self.sinks)}...")
+        fetched = []
+        total = 0
+        for result in self.fetcher.fetch_all(self.vehicle_ids, self.service_date):
+            vehicle_id = result.vehicle_id
+            if result.error is not None:
+                print(f"Error for {vehicle_id}: {result.error}")
+                continue
+            if result.unchanged:
+                continue
+            if result.status_code != 200 or not result.content:
+                print(f"Failed to fetch data for {vehicle_id}")
+                continue
+            # fetched and parsed once, then fanned out to every sink
+            with REGISTRY.timer("parse_seconds", "stop-event page parse time"):
+                records = parse_stop_events(result.content).records
+            if records:
+                for sink in self.sinks:
+                    sink.submit(vehicle_id, records)
+                total += len(records)
+            fetched.append(result)
+
+        ok = all([sink.close() for sink in self.sinks])
+        if ok:
+            for result in fetched:
+                self.fetcher.commit(result)
+        print(f"Finished: {total} records from {len(fetched)} vehicles")
+        return ok
+
+
+def build_sinks(names, service_date, args):
+    sinks = []
+    for name in names:
+        if name == "archive":
+            sinks.append(ArchiveSink(os.path.join(BASE_DIR, "bus_data", service_date), max_pending=args.max_pending))
+        elif name == "pubsub":
+            transport = make_transport(
+                os.getenv("PUBSUB_TRANSPORT", "pubsub"),
+                topic_id="stop-events",
+                service_account_file=os.getenv("SERVICE_ACCOUNT_FILE"),
+                project_id="mov-data-eng",
+                spool_dir=os.getenv("SPOOL_DIR", os.path.join(BASE_DIR, "spool"))
+            )
+            sinks.append(PubSubSink(transport, service_date, records_per_message=args.records_per_message,
+                                    shards=int(os.getenv("PUBLISH_SHARDS", "0")), max_pending=args.max_pending))
+        elif name == "db":
+            sinks.append(TripLoaderSink(
+                binary=os.getenv("COPY_FORMAT", "text") == "binary",
+                quarantine_dir=os.path.join(BASE_DIR, "output", "quarantine"),
+                max_pending=args.max_pending
+            ))
+        else:
+            raise ValueError(f"unknown sink {name}")
+    return sinks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch every vehicle once and send its stop events to several sinks.")
+    parser.add_argument("--sinks", default="archive,pubsub,db", help="comma-separated: archive, pubsub, db")
+    parser.add_argument("--vehicle-file", default=os.path.join(BASE_DIR, "vehicle_IDs.txt"))
+    parser.add_argument("--max-pending", type=int, default=64, help="vehicles buffered per sink")
+    parser.add_argument("--records-per-message", type=int, default=int(os.getenv("RECORDS_PER_MESSAGE", "1")))
+    args = parser.parse_args(argv)
+
+    with open(args.vehicle_file) as f:
+        vehicle_ids = [line.strip() for line in f if line.strip()]
+    service_date = datetime.now(ZoneInfo("America/Los_Angeles")).strftime("%Y-%m-%d")
+    start_from_env()
+
+    sinks = build_sinks([name.strip() for name in args.sinks.split(",") if name.strip()], service_date, args)
+    with FetchEngine(
+        max_in_flight=int(os.getenv("FETCH_CONCURRENCY", "16")),
+        policy=RequestPolicy.from_env(),
+        cache=ResponseCache(os.getenv("RESPONSE_CACHE_DIR", os.path.join(BASE_DIR, "cache", "pipeline")))
+    ) as fetcher:
+        PipelineRunner(vehicle_ids, fetcher, sinks, service_date).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,127 +1,331 @@
-from google.cloud import pubsub_v1
-import requests
-import json
 from datetime import datetime
 from zoneinfo import ZoneInfo
+import argparse
 import os
+import signal
+import time
 from concurrent import futures
-from google.oauth2 import service_account
-from bs4 import BeautifulSoup
+from functools import partial
 from dotenv import load_dotenv
+from fetch_engine import FetchEngine
+from request_policy import RequestPolicy
+from stop_parser import parse_stop_events, parse_stop_rows
+from messages import (FORMAT_BATCH, FORMAT_COLUMNS, encode_record, encode_batch, encode_columns, chunk_records,
+                      message_attributes)
+from transport import PubSubTransport, make_transport
+from response_cache import ResponseCache
+from checkpoints import PublishCheckpoint
+from activity_index import ActivityIndex
+from metrics import REGISTRY, start_from_env
 
 load_dotenv()
 
+
+def service_date():
+    return datetime.now(ZoneInfo("America/Los_Angeles")).strftime("%Y-%m-%d")
+
+
 class StopEventPublisher:
-    def __init__(self, service_account_file, project_id, topic_id, vehicle_id_file):
+    def __init__(self, service_account_file, project_id, topic_id, vehicle_id_file, max_in_flight=16, fetch_timeout=30,
+                 records_per_message=1, batch_settings=None, flow_control=None, max_outstanding=1000, transport=None,
+                 cache_dir=None, checkpoint_file=None, activity_file=None, spread_seconds=0, metrics_dir=None,
+                 request_policy=None, stop_rows=False, rows_per_message=1000, message_ordering=False, shards=0):
         self.service_account_file = service_account_file
         self.project_id = project_id
         self.topic_id = topic_id
         self.vehicle_id_file = vehicle_id_file
-        self.publisher = self._init_publisher()
-        self.topic_path = self.publisher.topic_path(self.project_id, self.topic_id)
+        self.records_per_message = records_per_message
+        # stop_rows: every stop of every trip, kept and sent as typed columns
+        # (rows_per_message rows per message) instead of one dict per trip
+        self.stop_rows = stop_rows
+        self.rows_per_message = rows_per_message
+        # message_ordering: per-vehicle ordering keys (the subscription must have
+        # ordering enabled too); shards > 0 adds a shard attribute for filtered subscriptions
+        self.message_ordering = message_ordering
+        self.shards = shards
+        # Pub/Sub defaults (and the import) are left to PubSubTransport
+        self.batch_settings = batch_settings
+        self.flow_control = flow_control
+        self.max_outstanding = max_outstanding
+        self.transport = transport or self._init_transport()
+        cache = ResponseCache(cache_dir) if cache_dir else None
+        self.fetcher = FetchEngine(max_in_flight=max_in_flight, read_timeout=fetch_timeout, cache=cache, policy=request_policy)
+        self.checkpoints = PublishCheckpoint(checkpoint_file) if checkpoint_file else None
+        self.activity = ActivityIndex(activity_file) if activity_file else None
+        self.spread_seconds = spread_seconds
+        self.metrics_dir = metrics_dir
         self.vehicle_ids = self._load_vehicle_ids()
-        self.today = datetime.now(ZoneInfo("America/Los_Angeles")).strftime("%Y-%m-%d")
+        # recomputed at the start of every publish() cycle
+        self.today = service_date()
         self.count = 0
-        self.future_list = []
+        # unresolved publish future -> (service_date, vehicle_id, trip_ids); vehicles
+        # with a failed publish this cycle don't get their page committed to the cache
+        self.pending = {}
+        self.failed_vehicles = set()
 
-    def _init_publisher(self):
-        credentials = service_account.Credentials.from_service_account_file(self.service_account_file)
-        return pubsub_v1.PublisherClient(credentials=credentials)
+    def _init_transport(self):
+        return PubSubTransport(
+            self.service_account_file,
+            self.project_id,
+            topic_id=self.topic_id,
+            batch_settings=self.batch_settings,
+            flow_control=self.flow_control,
+            enable_message_ordering=self.message_ordering,
+            max_outstanding=self.max_outstanding
+        )
 
     def _load_vehicle_ids(self):
         with open(self.vehicle_id_file, "r") as f:
             return [line.strip() for line in f if line.strip()]
 
-    def _future_callback(self, future):
+    def _scheduled_vehicle_ids(self):
+        if self.activity is None:
+            return self.vehicle_ids
+        scheduled = self.activity.schedule(self.vehicle_ids, self.today)
+        print(f"Scheduled {len(scheduled)} of {len(self.vehicle_ids)} vehicles")
+        return scheduled
+
+    def _record_activity(self, vehicle_id, record_count):
+        if self.activity is not None:
+            self.activity.record(vehicle_id, self.today, record_count)
+
+    def _future_callback(self, started, future):
+        REGISTRY.histogram("publish_seconds", "publish call to server ack").observe(time.perf_counter() - started)
+        REGISTRY.gauge("publish_outstanding", "publish futures not yet resolved").dec()
         try:
             future.result()
+            REGISTRY.counter("messages_published_total", "messages acked by the transport").inc()
         except Exception as e:
+            REGISTRY.counter("publish_errors_total", "messages that failed to publish").inc()
             print(f"Error publishing message: {e}")
 
-    def _parse(self, html_content):
-        soup = BeautifulSoup(html_content, "lxml")
-        tables = soup.find_all("table")
-        h2s = soup.find_all("h2")
-        trip_ids = [str(h2).strip("</h2>").split()[-1] for h2 in h2s]
-
-        all_records = []
-        trip_id_counter = 0
-        for table in tables:
-            if int(trip_ids[trip_id_counter]) <= 0:
-                trip_id_counter += 1
-                continue
+    def _track(self, future, vehicle_id, trip_ids=None):
+        # cap the number of futures held in memory instead of keeping the whole day's
+        self.pending[future] = (self.today, vehicle_id, trip_ids)
+        if len(self.pending) >= self.max_outstanding:
+            done, _ = futures.wait(self.pending, return_when=futures.FIRST_COMPLETED)
+            self._settle(done)
 
-            headers = [th.text.strip() for th in table.find_all("th")]
-            headers.append("trip_id")
+    def _settle(self, done):
+        # runs on the publishing thread, so checkpoint marks never race close()
+        for future in done:
+            service_date, vehicle_id, trip_ids = self.pending.pop(future)
+            if future.exception() is not None:
+                self.failed_vehicles.add(vehicle_id)
+            elif trip_ids is not None:
+                self.checkpoints.mark(service_date, vehicle_id, trip_ids)
 
-            first_row = table.find_all("tr")[1]
-            cells = [td.text.strip() for td in first_row.find_all("td")]
+    def _wait_all(self):
+        done, _ = futures.wait(self.pending)
+        self._settle(done)
+        if self.checkpoints is not None:
+            self.checkpoints.flush()
 
-            if cells:
-                record = dict(zip(headers, cells))
-                record["trip_id"] = trip_ids[trip_id_counter]
-                all_records.append(record)
+    def _trip_ids(self, records):
+        if self.stop_rows:
+            return records.trip_ids()
+        return [record["trip_id"] for record in records]
 
-            trip_id_counter += 1
+    def _routes(self, records):
+        if self.stop_rows:
+            column = records.columns.get("route_number")
+            return column.tolist() if column is not None else []
+        return [record.get("route_number") for record in records]
 
-        return all_records
+    def _send(self, data, vehicle_id, records, **attributes):
+        attributes.update(message_attributes(vehicle_id, self.today, self._routes(records), self.shards))
+        ordering_key = str(vehicle_id) if self.message_ordering else None
+        return self.transport.publish(data, ordering_key=ordering_key, **attributes)
+
+    def _publish_records(self, vehicle_id, records):
+        if self.stop_rows:
+            for chunk in records.chunks(self.rows_per_message):
+                yield self._send(encode_columns(chunk), vehicle_id, chunk, format=FORMAT_COLUMNS), chunk
+            return
+        if self.records_per_message == 1:
+            for record in records:
+                yield self._send(encode_record(record), vehicle_id, [record]), [record]
+            return
+        for chunk in chunk_records(records, self.records_per_message):
+            yield self._send(encode_batch(chunk), vehicle_id, chunk, format=FORMAT_BATCH), chunk
+
+    def _parse(self, html_content):
+        with REGISTRY.timer("parse_seconds", "stop-event page parse time"):
+            result = parse_stop_rows(html_content) if self.stop_rows else parse_stop_events(html_content)
+        REGISTRY.counter("records_parsed_total", "stop-event records parsed").inc(len(result.records))
+        return result
 
     def publish(self):
+        self.today = service_date()
+        self.vehicle_ids = self._load_vehicle_ids()
         print(f"Publishing Stop Events data for {self.today}...")
 
-        for vehicle_id in self.vehicle_ids:
-            url = f"https://busdata.cs.pdx.edu/api/getStopEvents?vehicle_num={vehicle_id}"
+        published = []
+        self.failed_vehicles = set()
+        vehicle_ids = self._scheduled_vehicle_ids()
+        for result in self.fetcher.fetch_all(vehicle_ids, self.today, spread_seconds=self.spread_seconds):
+            vehicle_id = result.vehicle_id
+            content = result.content
 
             try:
-                response = requests.get(url)
-                content = response.text.strip()
+                if result.error is not None:
+                    print(f"Error for {vehicle_id}: {result.error}")
+                    continue
+
+                if result.unchanged:
+                    print(f"No changes for vehicle {vehicle_id} since last run")
+                    continue
 
-                if response.status_code == 404 or not content:
+                if result.status_code == 404 or not content:
                     print(f"Failed to fetch data for {vehicle_id}")
+                    self._record_activity(vehicle_id, 0)
                     continue
 
-                soup = BeautifulSoup(content, "lxml")
-                if not soup.find_all("table"):
+                table_count, records = self._parse(content)
+                self._record_activity(vehicle_id, len(self._trip_ids(records)))
+                if not table_count:
                     print(f"No data table found for vehicle {vehicle_id}")
+                    self.fetcher.commit(result)
                     continue
 
-                records = self._parse(content)
-
                 if not records:
                     print(f"No data found for vehicle {vehicle_id}")
+                    self.fetcher.commit(result)
                     continue
 
-                for record in records:
-                    message = json.dumps(record).encode("utf-8")
-                    future = self.publisher.publish(self.topic_path, data=message)
-                    future.add_done_callback(self._future_callback)
-                    self.future_list.append(future)
+                if self.checkpoints is not None:
+                    if self.stop_rows:
+                        records = records.without_trips(self.checkpoints.published(self.today, vehicle_id))
+                    else:
+                        records = self.checkpoints.filter_new(self.today, vehicle_id, records)
+                    if not records:
+                        print(f"No new trips for vehicle {vehicle_id}")
+                        self.fetcher.commit(result)
+                        continue
+
+                messages = 0
+                started = time.perf_counter()
+                for future, sent in self._publish_records(vehicle_id, records):
+                    REGISTRY.gauge("publish_outstanding", "publish futures not yet resolved").inc()
+                    future.add_done_callback(partial(self._future_callback, started))
+                    trip_ids = self._trip_ids(sent) if self.checkpoints is not None else None
+                    self._track(future, vehicle_id, trip_ids)
+                    messages += 1
                     self.count += 1
 
                     if self.count % 50000 == 0:
                         print(f"Published {self.count} messages.")
+                    # the next message's publish call starts here
+                    started = time.perf_counter()
 
-                print(f"Published {len(records)} messages for vehicle {vehicle_id}")
+                print(f"Published {messages} messages for vehicle {vehicle_id}")
                 print(f"Wrote {len(records)} records for vehicle {vehicle_id}")
+                published.append(result)
 
             except Exception as e:
                 print(f"Error for {vehicle_id}: {e}")
 
-        for future in futures.as_completed(self.future_list):
-            continue
+        self._wait_all()
+        # only mark pages as seen once everything from them has been sent; a
+        # vehicle with any failed publish is fetched and sent again next run
+        for result in published:
+            if result.vehicle_id in self.failed_vehicles:
+                print(f"Not caching vehicle {result.vehicle_id}: some messages failed to publish")
+                continue
+            self.fetcher.commit(result)
+        if self.activity is not None:
+            self.activity.save()
+        if self.metrics_dir:
+            REGISTRY.write_summary(os.path.join(self.metrics_dir, f"publisher-{self.today}-{int(time.time())}.json"))
 
         print(f"Finished gathering stop event for {self.today}")
 
+    def run_forever(self, interval):
+        # daemon mode: the transport's client, the HTTP session and the parser stay
+        # loaded between cycles; each cycle starts interval seconds after the last began
+        signal.signal(signal.SIGTERM, _terminate)
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    self.publish()
+                except Exception as e:
+                    print(f"Error in publish cycle: {e}")
+                REGISTRY.histogram("publish_cycle_seconds", "full publish() cycle time").observe(time.monotonic() - started)
+                time.sleep(max(0, started + interval - time.monotonic()))
+        except KeyboardInterrupt:
+            print("stopping")
+        finally:
+            self.close()
+
+    def close(self):
+        self._wait_all()
+        self.fetcher.close()
+        self.transport.close()
+        if self.checkpoints is not None:
+            self.checkpoints.close()
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch stop events for every vehicle and publish them.")
+    parser.add_argument("--daemon", action="store_true", help="keep running, one collection cycle every --interval seconds")
+    parser.add_argument("--interval", type=float, default=float(os.getenv("PUBLISH_INTERVAL", "900")))
+    parser.add_argument("--dry-run", action="store_true",
+                        help="fetch and parse but publish nothing and leave cache, checkpoints and activity untouched")
+    args = parser.parse_args(argv)
 
-if __name__ == "__main__":
     SERVICE_ACCOUNT_FILE = os.getenv("SERVICE_ACCOUNT_FILE")
     VEHICLE_ID_FILE = "/opt/shared/mov-data-pipeline-stop/vehicle_IDs.txt"
+    TRANSPORT = "null" if args.dry_run else os.getenv("PUBSUB_TRANSPORT", "pubsub")
+
+    transport = None
+    if TRANSPORT != "pubsub":
+        transport = make_transport(
+            TRANSPORT,
+            topic_id="stop-events",
+            spool_dir=os.getenv("SPOOL_DIR", "/opt/shared/mov-data-pipeline-stop/spool")
+        )
+
+    def unless_dry_run(value):
+        return None if args.dry_run else value
 
     publisher = StopEventPublisher(
         service_account_file=SERVICE_ACCOUNT_FILE,
         project_id="mov-data-eng",
         topic_id="stop-events",
-        vehicle_id_file=VEHICLE_ID_FILE
+        vehicle_id_file=VEHICLE_ID_FILE,
+        max_in_flight=int(os.getenv("FETCH_CONCURRENCY", "16")),
+        fetch_timeout=float(os.getenv("FETCH_TIMEOUT", "30")),
+        records_per_message=int(os.getenv("RECORDS_PER_MESSAGE", "1")),
+        batch_settings={
+            "max_messages": int(os.getenv("PUBLISH_BATCH_MESSAGES", "100")),
+            "max_bytes": int(os.getenv("PUBLISH_BATCH_BYTES", "1000000")),
+            "max_latency": float(os.getenv("PUBLISH_BATCH_LATENCY", "0.05"))
+        },
+        max_outstanding=int(os.getenv("PUBLISH_MAX_OUTSTANDING", "1000")),
+        transport=transport,
+        cache_dir=unless_dry_run(os.getenv("RESPONSE_CACHE_DIR", "/opt/shared/mov-data-pipeline-stop/cache/publish")),
+        checkpoint_file=unless_dry_run(os.getenv("PUBLISH_CHECKPOINT", "/opt/shared/mov-data-pipeline-stop/published.sqlite")),
+        activity_file=unless_dry_run(os.getenv("ACTIVITY_INDEX", "/opt/shared/mov-data-pipeline-stop/activity_publish.json")),
+        spread_seconds=float(os.getenv("FETCH_SPREAD_SECONDS", "0")),
+        metrics_dir=unless_dry_run(os.getenv("METRICS_DIR", "/opt/shared/mov-data-pipeline-stop/metrics")),
+        request_policy=RequestPolicy.from_env(),
+        stop_rows=os.getenv("STOP_ROWS", "0") == "1",
+        rows_per_message=int(os.getenv("STOP_ROWS_PER_MESSAGE", "1000")),
+        message_ordering=os.getenv("PUBLISH_ORDERING", "0") == "1",
+        shards=int(os.getenv("PUBLISH_SHARDS", "0"))
     )
-    publisher.publish()
+    start_from_env()
+    if args.daemon:
+        publisher.run_forever(args.interval)
+    else:
+        publisher.publish()
+        publisher.close()
+
 
+if __name__ == "__main__":
+    main()
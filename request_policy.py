@@ -0,0 +1,174 @@
+import os
+import random
+import threading
+import time
+import requests
+from metrics import REGISTRY
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(requests.RequestException):
+    pass
+
+
+class RateLimiter:
+    # token bucket shared by every worker thread
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded("run deadline reached while rate limited")
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    # opens after `threshold` consecutive failures; while open, callers wait out
+    # the cooldown, then a single trial request decides whether it closes again
+    def __init__(self, threshold=10, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 0
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self.trial_in_flight:
+                return min(1.0, self.cooldown)
+            self.trial_in_flight = True
+            return 0
+
+    def release_trial(self):
+        # the claimed trial never reached the API (run deadline): let the next caller try
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    print(f"busdata API looks down after {self.failures} failures, pausing requests for {self.cooldown}s")
+                    REGISTRY.counter("circuit_opened_total", "times the API circuit breaker opened").inc()
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+
+class RequestPolicy:
+    def __init__(self, connect_timeout=5, read_timeout=30, max_retries=3, backoff_base=0.5, backoff_max=30,
+                 deadline_seconds=None, rate_per_second=None, breaker_threshold=10, breaker_cooldown=30):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline_seconds = deadline_seconds
+        self.limiter = RateLimiter(rate_per_second) if rate_per_second else None
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.deadline = None
+
+    @classmethod
+    def from_env(cls):
+        deadline = os.getenv("FETCH_DEADLINE")
+        rate = os.getenv("FETCH_RATE")
+        return cls(
+            connect_timeout=float(os.getenv("FETCH_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("FETCH_TIMEOUT", "30")),
+            max_retries=int(os.getenv("FETCH_RETRIES", "3")),
+            deadline_seconds=float(deadline) if deadline else None,
+            rate_per_second=float(rate) if rate else None
+        )
+
+    def start_run(self):
+        self.deadline = time.monotonic() + self.deadline_seconds if self.deadline_seconds else None
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _remaining(self):
+        if self.deadline is None:
+            return None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("run deadline reached")
+        return remaining
+
+    def _sleep(self, seconds):
+        remaining = self._remaining()
+        if remaining is not None and seconds >= remaining:
+            raise DeadlineExceeded("run deadline reached while backing off")
+        time.sleep(seconds)
+
+    def _backoff(self, attempt):
+        # full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def execute(self, send):
+        # send(timeout) performs one HTTP request; retried on connection errors,
+        # timeouts and retryable statuses until retries or the run deadline run out
+        attempt = 0
+        while True:
+            wait = self.breaker.wait_time()
+            while wait:
+                self._sleep(wait)
+                wait = self.breaker.wait_time()
+            # from here on this caller may hold the breaker's half-open trial,
+            # so every way out settles or releases it
+            try:
+                if self.limiter is not None:
+                    self.limiter.acquire(self.deadline)
+                remaining = self._remaining()
+                read_timeout = self.read_timeout if remaining is None else min(self.read_timeout, remaining)
+                response = send((self.connect_timeout, read_timeout))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.breaker.record_failure()
+                error, response = e, None
+            except DeadlineExceeded:
+                self.breaker.release_trial()
+                raise
+            except BaseException:
+                # anything else (a truncated body, a bad encoding) is not retried,
+                # but still settles the breaker: a half-open trial that never
+                # reports back would leave every other caller waiting on it
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                error = None
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                return response
+            attempt += 1
+            REGISTRY.counter("fetch_retries_total", "busdata API requests retried").inc()
+            self._sleep(self._backoff(attempt))
@@ -0,0 +1,55 @@
+import gzip
+import hashlib
+import json
+import os
+
+
+class ResponseCache:
+    # raw getStopEvents bodies, gzip'd and keyed by service date and vehicle,
+    # with a small JSON sidecar holding the content hash and HTTP validators
+    def __init__(self, root):
+        self.root = root
+
+    def _paths(self, vehicle_id, service_date):
+        directory = os.path.join(self.root, service_date)
+        return os.path.join(directory, f"{vehicle_id}.html.gz"), os.path.join(directory, f"{vehicle_id}.meta.json")
+
+    def meta(self, vehicle_id, service_date):
+        _, meta_path = self._paths(vehicle_id, service_date)
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def conditional_headers(self, vehicle_id, service_date):
+        meta = self.meta(vehicle_id, service_date)
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    @staticmethod
+    def content_hash(content):
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def is_unchanged(self, vehicle_id, service_date, content_hash):
+        return self.meta(vehicle_id, service_date).get("sha256") == content_hash
+
+    def store(self, vehicle_id, service_date, content, content_hash, etag=None, last_modified=None):
+        body_path, meta_path = self._paths(vehicle_id, service_date)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        with gzip.open(body_path, "wt", encoding="utf-8") as f:
+            f.write(content)
+        meta = {"sha256": content_hash, "etag": etag, "last_modified": last_modified}
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def load(self, vehicle_id, service_date):
+        body_path, _ = self._paths(vehicle_id, service_date)
+        with gzip.open(body_path, "rt", encoding="utf-8") as f:
+            return f.read()
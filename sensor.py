@@ -1,18 +1,37 @@
+import argparse
 import os
 import json
 from datetime import datetime
 from zoneinfo import ZoneInfo
+from archive import DayArchive, load_manifest
 
 now = datetime.now(ZoneInfo("America/Los_Angeles"))
 today = now.strftime("%Y-%m-%d")
-directory = f'/opt/shared/mov-data-pipeline-stop/bus_data/2025-05-28'
-count = 0
-for filename in os.listdir(directory):
-    if filename.endswith('.json'):
-        with open(os.path.join(directory, filename)) as f:
-            try:
-                data = json.load(f)
-                count += len(data)
-            except json.decoder.JSONDecodeError:
-                print(f"Error decoding {filename}")
-print(count)
+parser = argparse.ArgumentParser(description="Count the stop-event records collected for a service date.")
+parser.add_argument("day", nargs="?", default=today, help="service date (YYYY-MM-DD), defaults to today")
+parser.add_argument("--verify", action="store_true", help="check each archived vehicle's sha256")
+args = parser.parse_args()
+day = args.day
+verify = args.verify
+directory = f'/opt/shared/mov-data-pipeline-stop/bus_data/{day}'
+
+manifest = load_manifest(directory)
+if manifest is not None:
+    # counts straight from the manifest, no record parsing
+    archive = DayArchive(directory)
+    for problem in archive.check(verify=verify):
+        print(problem)
+    print(f"{len(manifest['vehicles'])} vehicles")
+    print(manifest["total_records"])
+else:
+    # days fetched before the packed archive existed
+    count = 0
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            with open(os.path.join(directory, filename)) as f:
+                try:
+                    data = json.load(f)
+                    count += len(data)
+                except json.decoder.JSONDecodeError:
+                    print(f"Error decoding {filename}")
+    print(count)
@@ -0,0 +1,342 @@
+from array import array
+
+INT = "q"
+FLOAT = "d"
+STR = "s"
+
+# getStopEvents columns; anything not listed is kept as a string column
+STOP_COLUMN_TYPES = {
+    "trip_id": INT,
+    "vehicle_number": INT,
+    "leave_time": INT,
+    "train": INT,
+    "route_number": INT,
+    "direction": STR,
+    "service_key": STR,
+    "trip_number": INT,
+    "stop_time": INT,
+    "arrive_time": INT,
+    "dwell": INT,
+    "location_id": INT,
+    "door": INT,
+    "lift": INT,
+    "ons": INT,
+    "offs": INT,
+    "estimated_load": INT,
+    "maximum_speed": FLOAT,
+    "train_mileage": FLOAT,
+    "pattern_distance": FLOAT,
+    "location_distance": FLOAT,
+    "x_coordinate": FLOAT,
+    "y_coordinate": FLOAT,
+    "data_source": INT,
+    "schedule_status": INT,
+}
+
+
+def _to_int(value):
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError(value)
+    return int(number)
+
+
+class Column:
+    # numbers live in a typed array with a presence mask (1 = value present);
+    # strings are dictionary-encoded, so each distinct value is stored once and
+    # a missing value is code -1
+    def __init__(self, kind):
+        self.kind = kind
+        self.nulls = 0
+        if kind == STR:
+            self.values = array("i")
+            self.categories = []
+            self._codes = {}
+            self.append = self._append_str
+        else:
+            self.values = array(kind)
+            self.mask = bytearray()
+            # row -> original value for cells that didn't convert; they are null
+            # in the array, but the frame shows the raw text so quarantine can
+            self.raw = {}
+            self.append = self._append_int if kind == INT else self._append_float
+
+    def __len__(self):
+        return len(self.values)
+
+    # append(value) is bound to one of these per kind; the common case is a
+    # single conversion, anything unparseable is stored as null plus its raw value
+
+    def _append_str(self, value):
+        self.values.append(self._code(value))
+
+    def _append_int(self, value):
+        try:
+            self.values.append(value if type(value) is int else int(value))
+        except (TypeError, ValueError, OverflowError):
+            try:
+                self.values.append(_to_int(value))
+            except (TypeError, ValueError, OverflowError):
+                self._append_invalid(value)
+                return
+        self.mask.append(1)
+
+    def _append_float(self, value):
+        try:
+            self.values.append(float(value))
+        except (TypeError, ValueError):
+            self._append_invalid(value)
+            return
+        self.mask.append(1)
+
+    def _append_invalid(self, value):
+        if value is not None:
+            self.raw[len(self.values)] = value
+        self.append_null()
+
+    def extend_values(self, values):
+        if self.kind != STR:
+            try:
+                converted = array(self.kind, map(int if self.kind == INT else float, values))
+            except (TypeError, ValueError, OverflowError):
+                converted = None
+            if converted is not None:
+                self.values.extend(converted)
+                self.mask.extend(b"\x01" * len(converted))
+                return
+        for value in values:
+            self.append(value)
+
+    def append_null(self, count=1):
+        self.nulls += count
+        if self.kind == STR:
+            self.values.extend([-1] * count)
+            return
+        self.values.extend([0 if self.kind == INT else float("nan")] * count)
+        self.mask.extend(bytes(count))
+
+    def _code(self, value):
+        if value is None:
+            self.nulls += 1
+            return -1
+        value = str(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.categories)
+            self.categories.append(value)
+        return code
+
+    def extend(self, other):
+        if self.kind == STR:
+            remap = [self._code(value) for value in other.categories]
+            self.values.extend(remap[code] if code >= 0 else -1 for code in other.values)
+            self.nulls += other.nulls
+            return
+        offset = len(self.values)
+        self.raw.update((offset + row, value) for row, value in other.raw.items())
+        self.values.extend(other.values)
+        self.mask.extend(other.mask)
+        self.nulls += other.nulls
+
+    def take(self, indices):
+        column = Column(self.kind)
+        if self.kind == STR:
+            column.categories = list(self.categories)
+            column._codes = dict(self._codes)
+            column.values = array("i", (self.values[i] for i in indices))
+            column.nulls = column.values.count(-1) if self.nulls else 0
+            return column
+        column.values = array(self.kind, (self.values[i] for i in indices))
+        column.mask = bytearray(self.mask[i] for i in indices)
+        column.nulls = column.mask.count(0) if self.nulls else 0
+        if self.raw:
+            column.raw = {row: self.raw[i] for row, i in enumerate(indices) if i in self.raw}
+        return column
+
+    def tolist(self):
+        if self.kind == STR:
+            return [self.categories, self.values.tolist()]
+        if not self.nulls:
+            return self.values.tolist()
+        values = [value if present else None for value, present in zip(self.values, self.mask)]
+        # raw values go out as they came in, so the receiver keeps them too
+        for row, value in self.raw.items():
+            values[row] = value
+        return values
+
+    @classmethod
+    def fromlist(cls, kind, values):
+        column = cls(kind)
+        if kind == STR:
+            categories, codes = values
+            column.categories = list(categories)
+            column._codes = {value: code for code, value in enumerate(column.categories)}
+            column.values = array("i", codes)
+            column.nulls = column.values.count(-1)
+            return column
+        for value in values:
+            column.append(value)
+        return column
+
+    def to_series(self, name):
+        # numeric columns without nulls share the array's buffer instead of copying
+        # it; the column can't grow while such a frame is alive. numpy/pandas are
+        # only needed here, so publishers never import them
+        import numpy as np
+        import pandas as pd
+        if self.kind == STR:
+            codes = np.frombuffer(self.values, dtype=np.int32)
+            return pd.Series(pd.Categorical.from_codes(codes, categories=self.categories), name=name)
+        if self.raw:
+            # left as objects for validation to coerce and quarantine with the raw text
+            return pd.Series(self.tolist(), name=name, dtype=object)
+        values = np.frombuffer(self.values, dtype=np.int64 if self.kind == INT else np.float64)
+        if self.nulls and self.kind == INT:
+            missing = np.frombuffer(self.mask, dtype=np.uint8) == 0
+            return pd.Series(pd.arrays.IntegerArray(values, missing), name=name)
+        return pd.Series(values, name=name, copy=False)
+
+
+def coerce_numeric(df, types=STOP_COLUMN_TYPES):
+    # typed columns that came out as objects because some cells kept their raw
+    # text; once validation has quarantined what it checks, the rest go back to
+    # numbers (unparseable cells as nulls) so the frame can be written as Arrow
+    import pandas as pd
+    for name in df.columns:
+        kind = types.get(name)
+        if kind not in (INT, FLOAT) or df[name].dtype != object:
+            continue
+        values = pd.to_numeric(df[name], errors="coerce")
+        if kind == INT:
+            values = values.where(values % 1 == 0).astype("Int64")
+        df[name] = values
+    return df
+
+
+class StopColumns:
+    # every stop row of a page (or a batch of pages) as one typed column per field
+    def __init__(self, types=STOP_COLUMN_TYPES):
+        self.types = types
+        self.columns = {}
+        self.length = 0
+        # field tuple -> column appenders, for streams of same-shaped records
+        self._layouts = {}
+
+    def __len__(self):
+        return self.length
+
+    def _column(self, name, kind=None):
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = Column(kind or self.types.get(name, STR))
+            if self.length:
+                # field first seen part way through: earlier rows didn't have it
+                column.append_null(self.length)
+        return column
+
+    def append_row(self, headers, cells, trip_id):
+        for header, cell in zip(headers, cells):
+            self._column(header).append(cell)
+        self._column("trip_id").append(trip_id)
+        self.length += 1
+        self._pad()
+
+    def append_record(self, record):
+        fields = tuple(record)
+        appends = self._layouts.get(fields)
+        if appends is None:
+            appends = self._layouts[fields] = [self._column(field).append for field in fields]
+        for append, value in zip(appends, record.values()):
+            append(value)
+        self.length += 1
+        if len(appends) != len(self.columns):
+            self._pad()
+
+    def append_rows(self, fields, rows):
+        # positional rows, as in batch messages; missing trailing cells become nulls
+        columns = [self._column(field) for field in fields]
+        width = len(columns)
+        if len(rows) > 1 and all(len(row) == width for row in rows):
+            # column at a time, so conversion runs over whole lists
+            for index, column in enumerate(columns):
+                column.extend_values([row[index] for row in rows])
+        else:
+            appends = [column.append for column in columns]
+            for row in rows:
+                for append, value in zip(appends, row):
+                    append(value)
+                for column in columns[len(row):]:
+                    column.append_null()
+        self.length += len(rows)
+        if width != len(self.columns):
+            self._pad()
+
+    def _pad(self):
+        for column in self.columns.values():
+            if len(column) < self.length:
+                column.append_null(self.length - len(column))
+
+    def extend(self, other):
+        for name, column in other.columns.items():
+            self._column(name, column.kind).extend(column)
+        self.length += other.length
+        self._pad()
+
+    def take(self, indices):
+        selected = StopColumns(self.types)
+        selected.columns = {name: column.take(indices) for name, column in self.columns.items()}
+        selected.length = len(indices)
+        return selected
+
+    def trip_ids(self):
+        trip_ids = self.columns.get("trip_id")
+        return list(dict.fromkeys(trip_ids.values)) if trip_ids is not None else []
+
+    def without_trips(self, trip_ids):
+        # trip_ids as strings, the way checkpoints store them
+        values = self.columns["trip_id"].values
+        return self.take([i for i, trip_id in enumerate(values) if str(trip_id) not in trip_ids])
+
+    def chunks(self, max_rows):
+        # split on trip boundaries so a trip is only ever in one message, unless
+        # the trip alone is bigger than max_rows
+        if max_rows <= 0 or self.length <= max_rows:
+            yield self
+            return
+        values = self.columns["trip_id"].values
+        start = 0
+        trip_start = 0
+        for end in range(1, self.length + 1):
+            if end < self.length and values[end] == values[end - 1]:
+                continue
+            # rows trip_start..end are one trip
+            if end - start > max_rows and trip_start > start:
+                yield self.take(range(start, trip_start))
+                start = trip_start
+            while end - start > max_rows:
+                yield self.take(range(start, start + max_rows))
+                start += max_rows
+            trip_start = end
+        if start < self.length:
+            yield self.take(range(start, self.length))
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame({name: column.to_series(name) for name, column in self.columns.items()}, copy=False)
+
+    def to_payload(self):
+        names = list(self.columns)
+        return {
+            "fields": names,
+            "types": [self.columns[name].kind for name in names],
+            "columns": [self.columns[name].tolist() for name in names]
+        }
+
+    @classmethod
+    def from_payload(cls, payload, types=STOP_COLUMN_TYPES):
+        columns = cls(types)
+        for name, kind, values in zip(payload["fields"], payload["types"], payload["columns"]):
+            columns.columns[name] = Column.fromlist(kind, values)
+        columns.length = len(columns.columns["trip_id"]) if columns.columns else 0
+        return columns
+
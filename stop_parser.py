@@ -0,0 +1,111 @@
+from collections import namedtuple
+from stop_columns import StopColumns
+
+CHUNK_SIZE = 64 * 1024
+
+ParseResult = namedtuple("ParseResult", ["table_count", "records"])
+
+
+def _text(element):
+    return "".join(element.itertext()).strip()
+
+
+def _release(element):
+    # drop the element and any already-processed siblings so the tree never grows
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def _trip_id(h2):
+    words = _text(h2).split()
+    return words[-1] if words else None
+
+
+def parse_stop_events(content):
+    # single streaming pass over the page: trip ids come from the <h2> tags, and
+    # from each table only the header row and the first data row are kept
+    return _parse(content, full_rows=False)
+
+
+def parse_stop_rows(content):
+    # every stop row of every trip, appended straight into typed columns;
+    # records is a StopColumns instead of a list of dicts
+    return _parse(content, full_rows=True)
+
+
+def _parse(content, full_rows):
+    # lxml is loaded by the first parse rather than at import time
+    from lxml import etree
+    parser = etree.HTMLPullParser(events=("end",))
+    trip_ids = []
+    records = StopColumns() if full_rows else []
+    table_count = 0
+    row_index = 0
+    headers = []
+    cells = []
+    trip_id = None
+
+    def handle(events):
+        nonlocal table_count, row_index, headers, cells, trip_id
+        for _, element in events:
+            tag = element.tag
+            if tag == "h2":
+                trip_id = _trip_id(element)
+                if trip_id is not None:
+                    trip_ids.append(trip_id)
+                _release(element)
+            elif tag == "tr":
+                if row_index == 0:
+                    headers = [_text(th) for th in element.iter("th")]
+                    if full_rows and table_count < len(trip_ids):
+                        trip_id = _valid_trip_id(trip_ids[table_count])
+                elif full_rows:
+                    if trip_id is not None:
+                        records.append_row(headers, [_text(td) for td in element.iter("td")], trip_id)
+                elif row_index == 1:
+                    cells = [_text(td) for td in element.iter("td")]
+                row_index += 1
+                _release(element)
+            elif tag == "table":
+                if not full_rows and table_count < len(trip_ids):
+                    record = _build_record(headers, cells, trip_ids[table_count])
+                    if record is not None:
+                        records.append(record)
+                table_count += 1
+                row_index = 0
+                headers = []
+                cells = []
+                trip_id = None
+                _release(element)
+
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="replace")
+    for start in range(0, len(content), CHUNK_SIZE):
+        parser.feed(content[start:start + CHUNK_SIZE])
+        handle(parser.read_events())
+    parser.close()
+    handle(parser.read_events())
+
+    return ParseResult(table_count, records)
+
+
+def _valid_trip_id(trip_id):
+    try:
+        if int(trip_id) <= 0:
+            return None
+    except ValueError:
+        return None
+    return trip_id
+
+
+def _build_record(headers, cells, trip_id):
+    if _valid_trip_id(trip_id) is None:
+        return None
+    if not cells:
+        return None
+    record = dict(zip(headers + ["trip_id"], cells))
+    record["trip_id"] = trip_id
+    return record
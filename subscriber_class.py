@@ -1,289 +1,271 @@
-from concurrent.futures import TimeoutError
-from google.cloud import pubsub_v1
-import json
 from datetime import datetime
-from google.oauth2 import service_account
-import pandas as pd
-import psycopg2
 import os
-import io
-import csv
+import queue
+import threading
+import time
 from dotenv import load_dotenv 
+from accumulator import BatchAccumulator
+from stop_columns import coerce_numeric
+from messages import matches_filter, parse_attribute_filter
+from transport import PubSubTransport, make_transport
+from validation import validate, write_quarantine
+from trip_store import TripIdIndex, to_trip_frame, copy_trips
+from db_pool import get_pool
+from output_sink import ColumnarSink
+from metrics import REGISTRY, start_from_env
 load_dotenv()
 
 class SubscriberTrip:
-  def __init__(self):
+  def __init__(self, transport=None, max_messages=1000, batch_size=5000, flush_interval=20, buffer_size=10000,
+               ack_after_commit=True, subscription_id="stop-events-sub", serialize_inserts=False, compact_every=50,
+               attribute_filter=None):
     self.project_id = "mov-data-eng"
-    self.subscription_id = "stop-events-sub"  
+    self.subscription_id = subscription_id
     self.SERVICE_ACCOUNT_FILE = os.getenv("SERVICE_ACCOUNT_FILE")
-    self.pubsub_creds2 = service_account.Credentials.from_service_account_file(self.SERVICE_ACCOUNT_FILE)
-    self.subscriber = pubsub_v1.SubscriberClient(credentials=self.pubsub_creds2)
-    self.subscription_path = self.subscriber.subscription_path(self.project_id, self.subscription_id)
-    self.json_data = []
+    self.transport = transport or PubSubTransport(self.SERVICE_ACCOUNT_FILE, self.project_id, subscription_id=self.subscription_id)
+    self.subscription_path = self.transport.name
+    self.max_messages = max_messages
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    # ack_after_commit: messages stay unacked until their batch is committed,
+    # then are acked (or nacked for redelivery) together; max_messages caps how
+    # many are held at once through the subscriber's flow control
+    self.ack_after_commit = ack_after_commit
+    # {attribute: allowed values}; other messages are acked and dropped undecoded
+    self.attribute_filter = attribute_filter or {}
+    # bounded: a full buffer blocks the callback and backs pressure up to the pull
+    self.buffer = queue.Queue(maxsize=buffer_size)
+    self.stop_event = threading.Event()
     self.TableName = 'trip'
+    self.binary_copy = os.getenv("COPY_FORMAT", "text") == "binary"
+    # set when several workers load the same table (see supervisor.py)
+    self.serialize_inserts = serialize_inserts
+    self.trip_index = TripIdIndex(capacity=int(os.getenv("TRIP_INDEX_CAPACITY", "1000000")))
     self.OUTPUT_DIR = '/opt/shared/mov-data-pipeline-stop/output'
+    self.QUARANTINE_DIR = os.path.join(self.OUTPUT_DIR, 'quarantine')
+    self.METRICS_DIR = os.getenv("METRICS_DIR", '/opt/shared/mov-data-pipeline-stop/metrics')
     os.makedirs(self.OUTPUT_DIR, exist_ok=True)
+    self.sink = ColumnarSink(self.OUTPUT_DIR, file_format=os.getenv("OUTPUT_FORMAT", "parquet"), compact_every=compact_every)
     
-  def db_connect(self):
-    return psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST")
-    )
-  
-
-
-
-  def validate_vehicle_no(self,df):
-    try:
-      var = pd.to_numeric(df['vehicle_number'], errors='coerce')
-      assert var.notna().all(), "vehicle_number contains null values"
-      df['vehicle_number'] = var
-      return df
-    except Exception as e:
-      print(f"Error validating column vehicle number: {e}")
-      return None
-
-  def validate_route_number(self,df):
-    try:
-      var = pd.to_numeric(df['route_number'], errors='coerce')
-      assert var.notna().all(), "route_number contains null values"
-      df['route_number'] = var
-      return df
-    except Exception as e:
-      print(f"Error validating column route number: {e}")
-      return None
-
-  def validate_trip_number(self,df):
-    try:
-      var = pd.to_numeric(df['trip_number'], errors='coerce')
-      assert var.notna().all(), "trip_number contains null values"
-      df['trip_number'] = var
-      return df
-    except Exception as e:
-      print(f"Error validating column trip number: {e}")
-      return None
-
-  def validate_direction(self,df):
-    try:
-      assert df['direction'].notna().all(), "direction contains null values"
-      df['direction'] = pd.to_numeric(df['direction'], errors='coerce')
-      assert df['direction'].notna().all(), "direction contains null values"
-      direct = [0,1]
-      assert df['direction'].isin(direct).all(), "direction must be either 0 or 1"
-      maps = {0: 'Out', 1: 'Back'}
-      df['direction'] = df['direction'].map(maps)
-      assert df['direction'].notna().all(), "direction contains null values"
-      assert df['direction'].isin(['Out', 'Back']).all(), "direction must be either Out or Back"
-      return df
-    except Exception as e:
-      print(f"Error validating column direction: {e}")
-      return None
-
-  def validate_service_key(self,df):
+  def seed_trip_index(self):
     try:
-      df['service_key'] = df['service_key'].astype(str).str.strip()
-      df['service_key'] = df['service_key'].str.upper()
-      keys = ['W', 'S', 'U']
-      
-      df['service_key'] = df['service_key'].apply(lambda x: x if x in keys else 'W')
-     
-      maps = {'W': 'Weekday', 'S': 'Saturday', 'U': 'Sunday'}
-      df['service_key'] = df['service_key'].replace(maps)
-      assert df['service_key'].isin(['Weekday', 'Saturday', 'Sunday']).all(), "service_key must be either Weekday, Saturday, or Sunday"
-      return df
+      with get_pool().connection() as conn:
+        seeded = self.trip_index.seed(conn, self.TableName)
+      print(f"seeded trip index with {seeded} trip ids")
     except Exception as e:
-      print(f"Error validating column service key: {e}")
-      return None
-
-  def validate_trip_id(self,df):
-    try:
-      var = pd.to_numeric(df['trip_id'], errors='coerce')
-      assert var.notna().all(), "trip_id contains null values"
-      df['trip_id'] = var
-      return df
-    except Exception as e:
-      print(f"Error validating column trip id: {e}")
-      return None
-
-  def validate_ons(self,df):
-    try:
-      var = pd.to_numeric(df['ons'], errors='coerce')
-      assert var.notna().all(), "ons contains null values"
-      df['ons'] = var
-      return df
-    except Exception as e:
-      print(f"Error validating column ons: {e}")
-      return None
-
-  def validate_offs(self,df):
-    try:
-      var = pd.to_numeric(df['offs'], errors='coerce')
-      assert var.notna().all(), "offs contains null values"
-      df['offs'] = var
-      return df
-    except Exception as e:
-      print(f"Error validating column offs: {e}")
-      return None
-  def validate_train(self,df):
-    try:
-      var = pd.to_numeric(df['train'], errors='coerce')
-      assert var.notna().all(), "train contains null values"
-      df['train'] = var
-      return df    
-    except Exception as e:
-      print(f"Error validating column train: {e}")
-      return None
-
-  def validate_max_speed(self,df):
-    try:
-      var = pd.to_numeric(df['maximum_speed'], errors='coerce')
-      assert var.notna().all(), "maximum_speed contains null values"
-      df['maximum_speed'] = var
-      return df
-    except Exception as e:
-      print(f"Error validating column maximum_speed: {e}")
-      return None
+      print(f"error seeding trip index: {e}")
 
   def validate_data(self,df):
-    df = self.validate_vehicle_no(df)
-    df = self.validate_route_number(df)
-    df = self.validate_trip_number(df)
-    df = self.validate_direction(df)
-    df = self.validate_service_key(df)
-    df = self.validate_trip_id(df)
-    df = self.validate_ons(df)
-    df = self.validate_offs(df)
-    df = self.validate_train(df)
-    df = self.validate_max_speed(df)
-    return df
+    with REGISTRY.timer("validate_seconds", "validate_data time per batch"):
+      df, quarantine = validate(df)
+    REGISTRY.counter("records_validated_total", "records that passed validation").inc(len(df))
+    REGISTRY.counter("records_quarantined_total", "records sent to quarantine").inc(len(quarantine))
+    write_quarantine(quarantine, self.QUARANTINE_DIR)
+    return coerce_numeric(df)
 
 
   def store_database(self,df):
-    conn = None
     try:
-      df_new = df.copy()
       required_columns = ['trip_id', 'route_number', 'vehicle_number', 'service_key', 'direction']
       for col in required_columns:
-        if col not in df_new.columns:
+        if col not in df.columns:
           print(f"Column {col} not found in DataFrame")
           return False
 
-      df_new = df_new.rename(columns={'trip_id':'trip_id', 'route_number':'route_id', 'vehicle_number':'vehicle_id', 'service_key':'service_key', 'direction':'direction'})
-      dataframe_data =  df_new[['trip_id', 'route_id', 'vehicle_id', 'service_key', 'direction']]
-
-      dataframe_data = dataframe_data.drop_duplicates(subset=['trip_id'])
-      
-
-      f = io.StringIO()
-      dataframe_data.to_csv(f, header=False, index=False, sep ='\t')
-      f.seek(0)
-      conn = self.db_connect()
-      with conn.cursor() as cursor:
-          cursor.copy_from(f, self.TableName, sep='\t')
+      dataframe_data = to_trip_frame(df)
+      # trip_ids already loaded (re-runs, redeliveries) are dropped before touching the DB
+      dataframe_data = self.trip_index.filter_new(dataframe_data)
+      if dataframe_data.empty:
+        print('no new trips to store')
+        return True
+
+      with REGISTRY.timer("store_seconds", "store_database time per batch"):
+        with get_pool().connection() as conn:
+          # messages are acked as soon as this commits, so it must survive a crash
+          inserted = copy_trips(conn, dataframe_data, self.TableName, binary=self.binary_copy,
+                                serialize=self.serialize_inserts, durable=self.ack_after_commit)
           conn.commit()
-          print(f'stored {len(dataframe_data)} records in database')
-          return True
+      REGISTRY.counter("records_stored_total", "rows inserted into the trip table").inc(inserted)
+      self.trip_index.add(dataframe_data['trip_id'])
+      print(f'stored {inserted} records in database')
+      return True
     except Exception as e:
+        REGISTRY.counter("store_errors_total", "failed store_database calls").inc()
         print(f"error storing in database{e}")  
-        if conn:  
-            conn.rollback()
         return False
-    finally:
-        if conn:
-          conn.close()
 
   def callback(self,message):
+    # decoding happens on the flusher, straight into the batch's columns, so the
+    # buffer only ever holds raw payloads
     try:
-      data = json.loads(message.data.decode('utf-8'))
-      self.json_data.append(data)
-      message.ack() 
+      REGISTRY.counter("messages_received_total", "messages received by the subscriber").inc()
+      if not matches_filter(message.attributes, self.attribute_filter):
+        REGISTRY.counter("messages_filtered_total", "messages dropped by the attribute filter").inc()
+        message.ack()
+        return
+      if not self.ack_after_commit:
+        self.buffer.put((message.data, message.attributes, None))
+        message.ack()
+        return
+      while not self.stop_event.is_set():
+        try:
+          self.buffer.put((message.data, message.attributes, message), timeout=1)
+          return
+        except queue.Full:
+          pass
+      # shutting down, nothing will flush it; let it be redelivered
+      message.nack()
     except Exception as e:
       print(f"Error processing message: {e}")
       message.nack()
-  
-
 
   def other_process(self,json_data):
-    if not json_data:
+    # returns (ok, df): ok is False when the batch should be redelivered
+    if not len(json_data):
       print("No data to process")
-      return None
+      return True, None
 
     try:
-      df = pd.DataFrame(json_data)
-      df = df.drop_duplicates(subset=['trip_id'])
+      df = json_data.to_frame()
       df = self.validate_data(df)
       print("data validation complete")
 
       if df is not None and not df.empty:
         save_db = self.store_database(df)
         if save_db:
-          json_data = df.to_dict(orient='records')
-          timestamp = datetime.now()
-          filename = os.path.join(self.OUTPUT_DIR, timestamp.strftime('%Y-%m-%d') + '.json')
           try:
-            with open(filename, 'a') as f:
-              for data in json_data:
-                json.dump(data, f)
-                f.write('\n')
-            print(f"Saved {len(json_data)} records to {filename}")
+            # partitioned by each message's service date, so a batch that spans
+            # midnight or replays an older day lands in the right directories
+            written = 0
+            for service_date, group in df.groupby('service_date', observed=True, sort=False):
+              written += self.sink.write(group.drop(columns=['service_date']), service_date)
+            print(f"Saved {written} records to {self.OUTPUT_DIR}")
           except Exception as e:
             print(f"Error saving data to file: {e}")
-          return df
+          return True, df
         else:
           print("Error storing data in database")
+          return False, None
       else:
         print("No valid data to process")
-      return None
+      return True, None
     except Exception as e:
       print(f"Error processing data: {e}")
-      return None
+      return False, None
+
+  def settle(self, messages, ok):
+    # the client library batches these into a few acknowledge/modifyAckDeadline calls
+    for message in messages:
+      if ok:
+        message.ack()
+      else:
+        message.nack()
+    if ok:
+      REGISTRY.counter("messages_acked_total", "messages acked after their batch committed").inc(len(messages))
+    else:
+      REGISTRY.counter("messages_nacked_total", "messages nacked because their batch failed").inc(len(messages))
+    REGISTRY.gauge("subscriber_unacked", "messages held until their batch commits").dec(len(messages))
+
+  def flush(self, batch, messages=()):
+    REGISTRY.gauge("subscriber_buffer_depth", "messages waiting in the flush buffer").set(self.buffer.qsize())
+    REGISTRY.histogram("flush_batch_records", "records per flushed batch").observe(len(batch))
+    ok, pro_df = self.other_process(batch)
+    if pro_df is not None:
+      print(f"successfully processed  {len(pro_df)} records")
+    if messages:
+      self.settle(messages, ok)
+
+  def flush_loop(self):
+    # hand a batch to validation/DB once it reaches batch_size records or
+    # flush_interval seconds, while the streaming pull keeps filling the buffer;
+    # with deferred acks it also flushes once flow control would stop delivery
+    batch = BatchAccumulator()
+    messages = []
+    deadline = time.monotonic() + self.flush_interval
+    while not (self.stop_event.is_set() and self.buffer.empty()):
+      try:
+        data, attributes, message = self.buffer.get(timeout=max(0, min(1, deadline - time.monotonic())))
+        self.decode(batch, data, attributes, message, messages)
+      except queue.Empty:
+        pass
+      if len(batch) >= self.batch_size or len(messages) >= self.max_messages or time.monotonic() >= deadline:
+        if batch.messages:
+          self.flush(batch, messages)
+        # a fresh accumulator each time: the flushed frame still shares the old buffers
+        batch = BatchAccumulator()
+        messages = []
+        deadline = time.monotonic() + self.flush_interval
+    if batch.messages:
+      self.flush(batch, messages)
+
+  def decode(self, batch, data, attributes, message, messages):
+    try:
+      batch.add_message(data, attributes)
+    except Exception as e:
+      print(f"Error decoding message: {e}")
+      if message is not None:
+        message.nack()
+      return
+    if message is not None:
+      messages.append(message)
+      REGISTRY.gauge("subscriber_unacked", "messages held until their batch commits").inc()
+
+  def cancel(self, streaming_pull_future):
+    try:
+      streaming_pull_future.cancel()
+      streaming_pull_future.result(timeout=3)
+    except Exception:
+      pass
+
+  def subscribe(self):
+    return self.transport.subscribe(self.callback, max_messages=self.max_messages)
 
   def run(self):
+    self.seed_trip_index()
     print(f"Listening for messages on {self.subscription_path}..\n")
-    try:   
+    flusher = threading.Thread(target=self.flush_loop, daemon=True)
+    flusher.start()
+    streaming_pull_future = self.subscribe()
+    try:
       while True:
         try:
-          streaming_pull_future = self.subscriber.subscribe(self.subscription_path, callback=self.callback)
-          streaming_pull_future.result(timeout=20)
-        except TimeoutError:
-          print("Timeout occurred")
+          streaming_pull_future.result()
         except Exception as e:
+          # the stream only ends on error; reopen it instead of dropping out
           print(f"subscription error: {e}")
-        finally:
-          try:
-            streaming_pull_future.cancel()
-            streaming_pull_future.result(timeout =3)
-          except:
-            pass
-        pro_df = self.other_process(self.json_data)
-        if pro_df is not None:
-          print(f"successfully processed  {len(pro_df)} records")
-        else:
-          print("no data to process")
-        self.json_data.clear()
+          time.sleep(5)
+          streaming_pull_future = self.subscribe()
     except KeyboardInterrupt:
       print('interrupted by keyboard')
-      print('process remaining data')
-      self.other_process(self.json_data)
-
     except Exception as e:
       print(f"Error processing loop: {e}")
+    finally:
+      if not self.ack_after_commit:
+        self.cancel(streaming_pull_future)
+      print('process remaining data')
+      self.stop_event.set()
+      flusher.join()
+      if self.ack_after_commit:
+        # closed only after the last batch is settled, so its acks still go out
+        self.cancel(streaming_pull_future)
+      REGISTRY.write_summary(os.path.join(self.METRICS_DIR, f"subscriber-{datetime.now():%Y-%m-%d-%H%M%S}.json"))
+
+def build_subscriber(**kwargs):
+  # a SubscriberTrip configured from the environment; kwargs override it
+  TRANSPORT = os.getenv("PUBSUB_TRANSPORT", "pubsub")
+  if TRANSPORT != "pubsub" and "transport" not in kwargs:
+    kwargs["transport"] = make_transport(TRANSPORT, topic_id="stop-events", spool_dir=os.getenv("SPOOL_DIR", "/opt/shared/mov-data-pipeline-stop/spool"))
+  options = dict(
+    max_messages=int(os.getenv("SUBSCRIBER_MAX_MESSAGES", "1000")),
+    batch_size=int(os.getenv("FLUSH_BATCH_SIZE", "5000")),
+    flush_interval=float(os.getenv("FLUSH_INTERVAL", "20")),
+    ack_after_commit=os.getenv("ACK_AFTER_COMMIT", "1") == "1",
+    attribute_filter=parse_attribute_filter(os.getenv("SUBSCRIBER_FILTER"))
+  )
+  options.update(kwargs)
+  return SubscriberTrip(**options)
 
 if __name__ == '__main__':
-  subscriber = SubscriberTrip()
+  subscriber = build_subscriber()
+  start_from_env()
   subscriber.run()
-          
-
-
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,186 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from dotenv import load_dotenv
+from metrics import REGISTRY, Registry, start_from_env
+
+load_dotenv()
+
+METRICS_DIR = os.getenv("METRICS_DIR", "/opt/shared/mov-data-pipeline-stop/metrics")
+
+
+def _report(snapshots, index, interval):
+    while True:
+        time.sleep(interval)
+        snapshots.put((index, os.getpid(), REGISTRY.snapshot()))
+
+
+def run_worker(index, snapshots, options, report_interval=10):
+    # runs in the child process: one SubscriberTrip, with its metrics shipped
+    # to the supervisor every report_interval seconds and once more on exit
+    os.setpgrp()  # terminal Ctrl-C goes to the supervisor, which stops workers in order
+    from subscriber_class import build_subscriber
+    subscriber = build_subscriber(**options)
+    threading.Thread(target=_report, args=(snapshots, index, report_interval), daemon=True).start()
+    try:
+        subscriber.run()
+    finally:
+        snapshots.put((index, os.getpid(), REGISTRY.snapshot()))
+
+
+class Supervisor:
+    def __init__(self, workers, subscription_id="stop-events-sub", shard_subscriptions=None, restart_delay=5,
+                 max_restart_delay=300, report_interval=10, shutdown_timeout=60, target=run_worker):
+        self.workers = workers
+        self.subscription_id = subscription_id
+        # e.g. "stop-events-sub-{shard}": one pre-created subscription per worker,
+        # filtered on attributes.shard = "<shard>" with PUBLISH_SHARDS=<workers> on the publisher
+        self.shard_subscriptions = shard_subscriptions
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.report_interval = report_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.target = target
+        # spawn, not fork: the Pub/Sub client's gRPC threads don't survive a fork
+        self.context = multiprocessing.get_context("spawn")
+        self.snapshots = self.context.Queue()
+        self.processes = {}
+        self.started = {}
+        self.delays = {}
+        self.restart_at = {}
+        # last snapshot per pid; exited workers keep theirs so totals survive restarts
+        self.latest = {}
+        self.own = Registry()
+        self.stopping = False
+
+    def worker_options(self, index):
+        if self.shard_subscriptions:
+            # shards are disjoint, so workers never insert the same trip_ids
+            return {"subscription_id": self.shard_subscriptions.format(shard=index),
+                    "compact_every": 50 if index == 0 else 0}
+        # one shared subscription: any worker may see any trip, so inserts are
+        # serialized with an advisory lock; only worker 0 compacts output files
+        return {"subscription_id": self.subscription_id, "serialize_inserts": True,
+                "compact_every": 50 if index == 0 else 0}
+
+    def start_worker(self, index):
+        process = self.context.Process(
+            target=self.target,
+            args=(index, self.snapshots, self.worker_options(index), self.report_interval),
+            name=f"subscriber-{index}",
+            daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+        self.started[index] = time.monotonic()
+        print(f"started worker {index} (pid {process.pid})")
+
+    def collect(self, timeout):
+        try:
+            index, pid, snapshot = self.snapshots.get(timeout=timeout)
+            while True:
+                self.latest[pid] = snapshot
+                index, pid, snapshot = self.snapshots.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _retire(self, pid):
+        # a dead worker's counters and histograms still count, its gauges don't
+        snapshot = self.latest.get(pid)
+        if snapshot is not None:
+            self.latest[pid] = {name: entry for name, entry in snapshot.items() if entry["kind"] != "gauge"}
+
+    def check(self):
+        now = time.monotonic()
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            del self.processes[index]
+            process.join()
+            self.collect(0)
+            self._retire(process.pid)
+            if self.stopping:
+                continue
+            # quick crashes back off; a worker that ran for a while restarts promptly
+            if now - self.started[index] > self.max_restart_delay:
+                delay = self.restart_delay
+            else:
+                delay = min(self.max_restart_delay, self.delays.get(index, self.restart_delay / 2) * 2)
+            self.delays[index] = delay
+            self.restart_at[index] = now + delay
+            self.own.counter("worker_restarts_total", "subscriber worker processes restarted").inc()
+            print(f"worker {index} (pid {process.pid}) exited with code {process.exitcode}, restarting in {delay:.1f}s")
+        for index, when in list(self.restart_at.items()):
+            if now >= when and not self.stopping:
+                del self.restart_at[index]
+                self.start_worker(index)
+
+    def merge(self):
+        self.own.gauge("workers_alive", "subscriber worker processes running").set(len(self.processes))
+        REGISTRY.load([self.own.snapshot()] + list(self.latest.values()))
+
+    def stop(self):
+        self.stopping = True
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        deadline = time.monotonic() + self.shutdown_timeout
+        for index, process in list(self.processes.items()):
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                print(f"worker {index} did not stop in time, terminating")
+                process.terminate()
+                process.join()
+        self.collect(1)
+        self.check()
+        self.merge()
+
+    def _terminate(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._terminate)
+        for index in range(self.workers):
+            self.start_worker(index)
+        try:
+            while True:
+                self.collect(self.report_interval)
+                self.check()
+                self.merge()
+        except KeyboardInterrupt:
+            print("stopping workers")
+        finally:
+            self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run several subscriber worker processes and restart them when they crash.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--subscription", default="stop-events-sub", help="subscription shared by every worker")
+    parser.add_argument("--shard-subscriptions",
+                        help="per-worker filtered subscriptions instead, e.g. stop-events-sub-{shard}")
+    parser.add_argument("--report-interval", type=float, default=10, help="seconds between worker metric reports")
+    parser.add_argument("--restart-delay", type=float, default=5)
+    args = parser.parse_args(argv)
+    if os.getenv("PUBSUB_TRANSPORT", "pubsub") != "pubsub":
+        # the memory queue is per process and the file spool has one reader offset
+        parser.error("worker processes need PUBSUB_TRANSPORT=pubsub")
+
+    supervisor = Supervisor(
+        args.workers,
+        subscription_id=args.subscription,
+        shard_subscriptions=args.shard_subscriptions,
+        restart_delay=args.restart_delay,
+        report_interval=args.report_interval
+    )
+    start_from_env()
+    supervisor.run()
+    REGISTRY.write_summary(os.path.join(METRICS_DIR, f"supervisor-{time.strftime('%Y-%m-%d-%H%M%S')}.json"))
+
+
+if __name__ == "__main__":
+    main()
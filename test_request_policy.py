@@ -0,0 +1,73 @@
+import time
+import unittest
+import requests
+from request_policy import CircuitBreaker, DeadlineExceeded, RequestPolicy
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def open_policy(self):
+        policy = RequestPolicy(max_retries=0, breaker_threshold=1, breaker_cooldown=0.05)
+        with self.assertRaises(requests.ConnectionError):
+            policy.execute(lambda timeout: (_ for _ in ()).throw(requests.ConnectionError("down")))
+        self.assertIsNotNone(policy.breaker.opened_at)
+        time.sleep(0.06)
+        return policy
+
+    def test_unexpected_error_in_trial_settles_breaker(self):
+        policy = self.open_policy()
+
+        def truncated(timeout):
+            raise requests.exceptions.ChunkedEncodingError("truncated body")
+
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            policy.execute(truncated)
+        self.assertFalse(policy.breaker.trial_in_flight)
+
+        # the breaker reopened on the failed trial; once the cooldown passes
+        # the next request is let through instead of waiting forever
+        time.sleep(0.06)
+        started = time.monotonic()
+        self.assertEqual(policy.execute(lambda timeout: Response(200)).status_code, 200)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertIsNone(policy.breaker.opened_at)
+
+    def test_deadline_before_send_releases_trial(self):
+        policy = RequestPolicy(max_retries=0, breaker_threshold=1, breaker_cooldown=0.05, rate_per_second=1,
+                               deadline_seconds=0.3)
+        policy.start_run()
+        with self.assertRaises(requests.ConnectionError):
+            policy.execute(lambda timeout: (_ for _ in ()).throw(requests.ConnectionError("down")))
+        time.sleep(0.06)
+        # the trial is claimed, then the rate limiter runs into the deadline
+        with self.assertRaises(DeadlineExceeded):
+            policy.execute(lambda timeout: Response(200))
+        self.assertFalse(policy.breaker.trial_in_flight)
+
+        # the next run (a new daemon cycle) reaches the API again
+        policy.limiter.tokens = 1
+        policy.start_run()
+        self.assertEqual(policy.execute(lambda timeout: Response(200)).status_code, 200)
+        self.assertIsNone(policy.breaker.opened_at)
+
+    def test_successful_trial_closes_breaker(self):
+        policy = self.open_policy()
+        self.assertEqual(policy.execute(lambda timeout: Response(200)).status_code, 200)
+        self.assertIsNone(policy.breaker.opened_at)
+        self.assertEqual(policy.breaker.failures, 0)
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(threshold=3, cooldown=30)
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertEqual(breaker.wait_time(), 0)
+        breaker.record_failure()
+        self.assertGreater(breaker.wait_time(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
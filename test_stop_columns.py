@@ -0,0 +1,44 @@
+import tempfile
+import unittest
+from accumulator import BatchAccumulator
+from messages import encode_record
+from output_sink import ColumnarSink
+from stop_columns import coerce_numeric
+from validation import validate
+
+
+def record(trip_id, **fields):
+    record = {"trip_id": trip_id, "vehicle_number": 3000, "route_number": 20, "direction": "0",
+              "service_key": "W", "trip_number": 1, "ons": 1, "offs": 1, "train": 1,
+              "maximum_speed": 3, "x_coordinate": 7650000.5, "estimated_load": 10}
+    record.update(fields)
+    return record
+
+
+class RawValuesTest(unittest.TestCase):
+    def frame(self, *records):
+        batch = BatchAccumulator()
+        for rec in records:
+            batch.add_message(encode_record(rec), {"service_date": "2024-05-01"})
+        return batch.to_frame()
+
+    def test_schema_column_keeps_raw_text_in_quarantine(self):
+        valid, quarantine = validate(self.frame(record(1), record(2, vehicle_number="abc")))
+        self.assertEqual(list(valid["trip_id"]), [1])
+        self.assertEqual(list(quarantine["vehicle_number"]), ["abc"])
+
+    def test_blank_cell_outside_schema_is_written(self):
+        valid, quarantine = validate(self.frame(record(1), record(2, x_coordinate="", estimated_load="n/a")))
+        self.assertTrue(quarantine.empty)
+        valid = coerce_numeric(valid)
+        self.assertEqual(valid["x_coordinate"].dtype.kind, "f")
+        self.assertTrue(valid["x_coordinate"].isna().iloc[1])
+        self.assertEqual(str(valid["estimated_load"].dtype), "Int64")
+        with tempfile.TemporaryDirectory() as root:
+            sink = ColumnarSink(root)
+            for service_date, group in valid.groupby("service_date", observed=True):
+                self.assertEqual(sink.write(group.drop(columns=["service_date"]), service_date), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,340 @@
+import base64
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent import futures
+
+
+def _pubsub():
+    # imported on first use, so local transports, --help and dry runs don't load grpc
+    from google.cloud import pubsub_v1
+    return pubsub_v1
+
+
+class PubSubTransport:
+    def __init__(self, service_account_file, project_id, topic_id=None, subscription_id=None,
+                 batch_settings=None, flow_control=None, enable_message_ordering=False, max_outstanding=None):
+        from google.oauth2 import service_account
+        pubsub_v1 = _pubsub()
+        self.service_account_file = service_account_file
+        self.project_id = project_id
+        self.topic_id = topic_id
+        self.subscription_id = subscription_id
+        # batch_settings may be a plain dict of BatchSettings fields
+        if isinstance(batch_settings, dict):
+            batch_settings = pubsub_v1.types.BatchSettings(**batch_settings)
+        self.batch_settings = batch_settings or pubsub_v1.types.BatchSettings()
+        if flow_control is None and max_outstanding:
+            # block the publish call, rather than error, once max_outstanding are in flight
+            flow_control = pubsub_v1.types.PublishFlowControl(
+                message_limit=max_outstanding,
+                limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK
+            )
+        self.flow_control = flow_control or pubsub_v1.types.PublishFlowControl()
+        self.enable_message_ordering = enable_message_ordering
+        self.credentials = service_account.Credentials.from_service_account_file(service_account_file)
+        self.topic_path = pubsub_v1.PublisherClient.topic_path(project_id, topic_id) if topic_id else None
+        self.subscription_path = pubsub_v1.SubscriberClient.subscription_path(project_id, subscription_id) if subscription_id else None
+        self._publisher = None
+        self._subscriber = None
+
+    @property
+    def publisher(self):
+        if self._publisher is None:
+            pubsub_v1 = _pubsub()
+            publisher_options = pubsub_v1.types.PublisherOptions(
+                flow_control=self.flow_control,
+                enable_message_ordering=self.enable_message_ordering
+            )
+            self._publisher = pubsub_v1.PublisherClient(self.batch_settings, publisher_options, credentials=self.credentials)
+        return self._publisher
+
+    @property
+    def subscriber(self):
+        if self._subscriber is None:
+            self._subscriber = _pubsub().SubscriberClient(credentials=self.credentials)
+        return self._subscriber
+
+    @property
+    def name(self):
+        return self.subscription_path or self.topic_path
+
+    def publish(self, data, ordering_key=None, **attributes):
+        if not (ordering_key and self.enable_message_ordering):
+            return self.publisher.publish(self.topic_path, data=data, **attributes)
+        future = self.publisher.publish(self.topic_path, data=data, ordering_key=ordering_key, **attributes)
+        future.add_done_callback(lambda f: self._resume(f, ordering_key))
+        return future
+
+    def _resume(self, future, ordering_key):
+        # a failed publish pauses its ordering key; the caller sees the error on
+        # the future, later messages for the key are accepted again
+        if future.exception() is not None:
+            self.publisher.resume_publish(self.topic_path, ordering_key)
+
+    def subscribe(self, callback, max_messages=1000):
+        flow_control = _pubsub().types.FlowControl(max_messages=max_messages)
+        return self.subscriber.subscribe(self.subscription_path, callback=callback, flow_control=flow_control)
+
+    def close(self):
+        if self._publisher is not None:
+            # sends whatever is still batched
+            self._publisher.stop()
+            self._publisher = None
+        if self._subscriber is not None:
+            self._subscriber.close()
+
+
+class LocalMessage:
+    def __init__(self, data, attributes, message_id, publish_time, on_ack, on_nack):
+        self.data = data
+        self.attributes = attributes
+        self.message_id = message_id
+        self.publish_time = publish_time
+        self._on_ack = on_ack
+        self._on_nack = on_nack
+        self._settled = False
+        self._lock = threading.Lock()
+
+    def _settle(self, action):
+        with self._lock:
+            if self._settled:
+                return
+            self._settled = True
+        action()
+
+    def ack(self):
+        self._settle(self._on_ack)
+
+    def nack(self):
+        self._settle(self._on_nack)
+
+
+class LocalStreamingPullFuture:
+    # same surface as the pubsub StreamingPullFuture: result(timeout) and cancel()
+    def __init__(self, target):
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=target, args=(self._stop,), daemon=True)
+        self._thread.start()
+
+    def result(self, timeout=None):
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise futures.TimeoutError()
+
+    def cancel(self):
+        self._stop.set()
+
+    def cancelled(self):
+        return self._stop.is_set()
+
+    def done(self):
+        return not self._thread.is_alive()
+
+
+def _completed(message_id):
+    future = futures.Future()
+    future.set_result(message_id)
+    return future
+
+
+class _LocalTransport:
+    poll_interval = 0.1
+
+    def subscribe(self, callback, max_messages=1000):
+        # flow control: at most max_messages delivered but not yet acked/nacked
+        slots = threading.BoundedSemaphore(max_messages)
+
+        def pull(stop):
+            while not stop.is_set():
+                if not slots.acquire(timeout=self.poll_interval):
+                    continue
+                item = self._next(self.poll_interval)
+                if item is None:
+                    slots.release()
+                    continue
+                message = self._message(item, slots)
+                try:
+                    callback(message)
+                except Exception as e:
+                    print(f"Error in subscriber callback: {e}")
+                    message.nack()
+
+        return LocalStreamingPullFuture(pull)
+
+    def _message(self, item, slots):
+        def on_ack():
+            self._ack(item)
+            slots.release()
+
+        def on_nack():
+            self._nack(item)
+            slots.release()
+
+        return LocalMessage(item["data"], item["attributes"], item["id"], item["time"], on_ack, on_nack)
+
+    def close(self):
+        pass
+
+
+class NullTransport:
+    # publishes nowhere; every publish succeeds at once (publisher dry runs)
+    name = "null"
+
+    def publish(self, data, ordering_key=None, **attributes):
+        return _completed(uuid.uuid4().hex)
+
+    def subscribe(self, callback, max_messages=1000):
+        raise RuntimeError("nothing to subscribe to on the null transport")
+
+    def close(self):
+        pass
+
+
+_QUEUES = {}
+_QUEUES_LOCK = threading.Lock()
+
+
+class QueueTransport(_LocalTransport):
+    # in-process stand-in; every transport created with the same topic shares one queue
+    def __init__(self, topic_id, max_pending=10000):
+        self.topic_id = topic_id
+        with _QUEUES_LOCK:
+            self.queue = _QUEUES.setdefault(topic_id, queue.Queue(maxsize=max_pending))
+        # nacked messages wait here, not back on the queue: a put on a full queue
+        # would block while the nacked message still holds its flow-control slot
+        self._redeliver = deque()
+
+    @property
+    def name(self):
+        return f"memory://{self.topic_id}"
+
+    def publish(self, data, ordering_key=None, **attributes):
+        # a single FIFO queue already keeps each key's messages in order
+        message_id = uuid.uuid4().hex
+        # blocks when max_pending messages are waiting: publisher-side flow control
+        self.queue.put({"id": message_id, "data": data, "attributes": attributes, "time": time.time()})
+        return _completed(message_id)
+
+    def _next(self, timeout):
+        if self._redeliver:
+            return self._redeliver.popleft()
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _ack(self, item):
+        pass
+
+    def _nack(self, item):
+        self._redeliver.append(item)
+
+
+class FileTransport(_LocalTransport):
+    # append-only NDJSON spool shared between processes on one machine;
+    # the subscriber commits its read offset once a contiguous prefix is acked
+    def __init__(self, topic_id, spool_dir, max_pending=10000):
+        self.topic_id = topic_id
+        self.spool_dir = spool_dir
+        self.max_pending = max_pending
+        os.makedirs(spool_dir, exist_ok=True)
+        self.path = os.path.join(spool_dir, f"{topic_id}.ndjson")
+        self.offset_path = os.path.join(spool_dir, f"{topic_id}.offset")
+        self._write_lock = threading.Lock()
+        self._ack_lock = threading.Lock()
+        self._reader = None
+        self._read_offset = None
+        self._in_flight = {}
+        self._redeliver = deque()
+
+    @property
+    def name(self):
+        return f"file://{self.path}"
+
+    def publish(self, data, ordering_key=None, **attributes):
+        # the spool is read in order, so ordering keys need no extra handling
+        message_id = uuid.uuid4().hex
+        line = json.dumps({
+            "id": message_id,
+            "data": base64.b64encode(data).decode("ascii"),
+            "attributes": attributes,
+            "time": time.time()
+        })
+        with self._write_lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+        return _completed(message_id)
+
+    def _committed_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _next(self, timeout):
+        if self._redeliver:
+            return self._redeliver.popleft()
+        if len(self._in_flight) >= self.max_pending:
+            time.sleep(timeout)
+            return None
+        if self._reader is None:
+            if not os.path.exists(self.path):
+                time.sleep(timeout)
+                return None
+            self._read_offset = self._committed_offset()
+            self._reader = open(self.path, "rb")
+        self._reader.seek(self._read_offset)
+        line = self._reader.readline()
+        if not line.endswith(b"\n"):
+            time.sleep(timeout)
+            return None
+        start = self._read_offset
+        self._read_offset += len(line)
+        item = json.loads(line)
+        item["data"] = base64.b64decode(item["data"])
+        item["offset"] = (start, self._read_offset)
+        with self._ack_lock:
+            self._in_flight[start] = False
+        return item
+
+    def _ack(self, item):
+        start, end = item["offset"]
+        with self._ack_lock:
+            self._in_flight[start] = end
+            committed = None
+            for offset in sorted(self._in_flight):
+                if not self._in_flight[offset]:
+                    break
+                committed = self._in_flight.pop(offset)
+            if committed is not None:
+                tmp_path = self.offset_path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(str(committed))
+                os.replace(tmp_path, self.offset_path)
+
+    def _nack(self, item):
+        self._redeliver.append(item)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+
+
+def make_transport(kind, topic_id=None, subscription_id=None, service_account_file=None,
+                   project_id=None, spool_dir=None, **pubsub_options):
+    if kind == "pubsub":
+        return PubSubTransport(service_account_file, project_id, topic_id=topic_id,
+                               subscription_id=subscription_id, **pubsub_options)
+    if kind == "memory":
+        return QueueTransport(topic_id)
+    if kind == "file":
+        return FileTransport(topic_id, spool_dir)
+    if kind == "null":
+        return NullTransport()
+    raise ValueError(f"unknown transport {kind}")
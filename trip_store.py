@@ -0,0 +1,170 @@
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+TRIP_COLUMNS = ['trip_id', 'route_id', 'vehicle_id', 'service_key', 'direction']
+COPY_CHUNK_ROWS = 1000
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+BINARY_TRAILER = struct.pack('!h', -1)
+BINARY_FORMATS = {'int2': '!ih', 'int4': '!ii', 'int8': '!iq', 'float4': '!if', 'float8': '!id'}
+COLUMN_MAP = {'trip_id': 'trip_id', 'route_number': 'route_id', 'vehicle_number': 'vehicle_id',
+              'service_key': 'service_key', 'direction': 'direction'}
+
+
+class TripIdIndex:
+    # bounded LRU of trip_ids already in the trip table, seeded from the DB at startup
+    def __init__(self, capacity=1000000):
+        self.capacity = capacity
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seed(self, conn, table='trip'):
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT trip_id FROM {table} ORDER BY trip_id DESC LIMIT %s", (self.capacity,))
+            trip_ids = [row[0] for row in cursor]
+        self.add(reversed(trip_ids))
+        return len(trip_ids)
+
+    def add(self, trip_ids):
+        with self._lock:
+            for trip_id in trip_ids:
+                trip_id = int(trip_id)
+                self._ids[trip_id] = None
+                self._ids.move_to_end(trip_id)
+            while len(self._ids) > self.capacity:
+                self._ids.popitem(last=False)
+
+    def __contains__(self, trip_id):
+        return int(trip_id) in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def filter_new(self, df, column='trip_id'):
+        with self._lock:
+            mask = [int(trip_id) not in self._ids for trip_id in df[column]]
+        return df[mask]
+
+
+def to_trip_frame(df):
+    trips = df.rename(columns=COLUMN_MAP)[TRIP_COLUMNS]
+    return trips.drop_duplicates(subset=['trip_id'])
+
+
+class CopyStream:
+    # file-like wrapper over a generator of byte chunks, so copy_expert pulls
+    # rows as it sends them instead of reading one big pre-rendered buffer
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def _row_blocks(df):
+    rows = df.itertuples(index=False, name=None)
+    block = []
+    for row in rows:
+        block.append(row)
+        if len(block) >= COPY_CHUNK_ROWS:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def _text_value(value):
+    if value is None or value != value:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def text_rows(df):
+    for block in _row_blocks(df):
+        yield ''.join('\t'.join(_text_value(v) for v in row) + '\n' for row in block).encode('utf-8')
+
+
+def _binary_encoder(typname):
+    fmt = BINARY_FORMATS.get(typname)
+    if fmt is not None:
+        size = struct.calcsize(fmt) - 4
+        return lambda value: struct.pack(fmt, size, value)
+
+    def encode_text(value):
+        data = str(value).encode('utf-8')
+        return struct.pack('!i', len(data)) + data
+    # text, varchar and enum labels share the same wire format
+    return encode_text
+
+
+def binary_rows(df, typnames):
+    encoders = [_binary_encoder(typname) for typname in typnames]
+    field_count = struct.pack('!h', len(encoders))
+    yield BINARY_HEADER
+    for block in _row_blocks(df):
+        out = bytearray()
+        for row in block:
+            out += field_count
+            for encode, value in zip(encoders, row):
+                if value is None or value != value:
+                    out += struct.pack('!i', -1)
+                else:
+                    out += encode(value)
+        yield bytes(out)
+    yield BINARY_TRAILER
+
+
+_COLUMN_TYPES = {}
+
+
+def column_types(cursor, table):
+    if table not in _COLUMN_TYPES:
+        cursor.execute(
+            "SELECT a.attname, t.typname FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid "
+            "WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped",
+            (table,)
+        )
+        _COLUMN_TYPES[table] = dict(cursor.fetchall())
+    return _COLUMN_TYPES[table]
+
+
+def advisory_key(table):
+    return zlib.crc32(table.encode("utf-8"))
+
+
+def copy_trips(conn, df, table='trip', binary=False, serialize=False, durable=False):
+    # stream rows into a session-local staging table, then insert only trip_ids
+    # the table doesn't have yet; the caller commits. Inserts go in trip_id order
+    # so concurrent loaders lock keys in the same order; serialize additionally
+    # holds a transaction-level advisory lock so only one loader inserts at a time.
+    # durable waits for the WAL flush on this commit despite the pool's
+    # synchronous_commit=off, for callers that ack upstream once it returns
+    staging = f"{table}_staging"
+    columns = ', '.join(TRIP_COLUMNS)
+    with conn.cursor() as cursor:
+        if durable:
+            cursor.execute("SET LOCAL synchronous_commit = on")
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        if binary:
+            types = column_types(cursor, table)
+            stream = CopyStream(binary_rows(df, [types[column] for column in TRIP_COLUMNS]))
+            cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT binary)", stream)
+        else:
+            cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN", CopyStream(text_rows(df)))
+        if serialize:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (advisory_key(table),))
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} ORDER BY trip_id ON CONFLICT (trip_id) DO NOTHING"
+        )
+        return cursor.rowcount
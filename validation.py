@@ -0,0 +1,91 @@
+import os
+from datetime import datetime
+import pandas as pd
+
+SERVICE_KEYS = {'W': 'Weekday', 'S': 'Saturday', 'U': 'Sunday'}
+DIRECTIONS = {0: 'Out', 1: 'Back'}
+
+# one entry per column: target dtype, plus optional normalisation, allowed
+# values, value mapping, default for unknown values and nullability
+TRIP_SCHEMA = {
+    'vehicle_number': {'dtype': 'int32'},
+    'route_number': {'dtype': 'int32'},
+    'trip_number': {'dtype': 'int32'},
+    'direction': {'dtype': 'category', 'numeric': True, 'allowed': list(DIRECTIONS), 'map': DIRECTIONS},
+    'service_key': {'dtype': 'category', 'upper': True, 'map': SERVICE_KEYS, 'default': 'W'},
+    'trip_id': {'dtype': 'int64'},
+    'ons': {'dtype': 'int32'},
+    'offs': {'dtype': 'int32'},
+    'train': {'dtype': 'int32'},
+    'maximum_speed': {'dtype': 'float32'},
+}
+
+
+def _convert_category(series, spec):
+    if spec.get('numeric'):
+        series = pd.to_numeric(series, errors='coerce')
+    else:
+        series = series.astype(str).str.strip()
+        if spec.get('upper'):
+            series = series.str.upper()
+    if 'default' in spec:
+        series = series.where(series.isin(list(spec['map'])), spec['default'])
+    invalid = series.isna()
+    if 'allowed' in spec:
+        invalid |= ~series.isin(spec['allowed'])
+    categories = list(dict.fromkeys(spec['map'].values()))
+    mapped = pd.Categorical(series.map(spec['map']), categories=categories)
+    return pd.Series(mapped, index=series.index), invalid
+
+
+def _convert_numeric(series, spec):
+    numeric = pd.to_numeric(series, errors='coerce')
+    invalid = numeric.isna()
+    if spec['dtype'].startswith('int'):
+        invalid |= numeric.notna() & (numeric % 1 != 0)
+    return numeric, invalid
+
+
+def validate(df, schema=TRIP_SCHEMA):
+    # single vectorised pass; returns (valid rows with compact dtypes, quarantined raw rows + reason)
+    converted = {}
+    errors = pd.DataFrame(False, index=df.index, columns=list(schema))
+    for column, spec in schema.items():
+        if column not in df.columns:
+            if not spec.get('nullable'):
+                errors[column] = True
+            continue
+        if spec['dtype'] == 'category':
+            values, invalid = _convert_category(df[column], spec)
+        else:
+            values, invalid = _convert_numeric(df[column], spec)
+        if spec.get('nullable'):
+            invalid &= df[column].notna()
+        converted[column] = values
+        errors[column] = invalid
+
+    bad = errors.any(axis=1)
+    valid = df.loc[~bad].copy()
+    for column, values in converted.items():
+        spec = schema[column]
+        values = values.loc[~bad]
+        if spec['dtype'] != 'category' and not spec.get('nullable'):
+            values = values.astype(spec['dtype'])
+        valid[column] = values
+
+    quarantine = df.loc[bad].copy()
+    if not quarantine.empty:
+        quarantine['reason'] = errors.loc[bad].dot(errors.columns + ',').str.rstrip(',')
+    return valid, quarantine
+
+
+def write_quarantine(quarantine, directory):
+    if quarantine is None or quarantine.empty:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, datetime.now().strftime('%Y-%m-%d') + '.json')
+    with open(filename, 'a') as f:
+        text = quarantine.to_json(orient='records', lines=True)
+        f.write(text if text.endswith('\n') else text + '\n')
+    print(f"quarantined {len(quarantine)} records to {filename}")
+    return filename